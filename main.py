@@ -7,8 +7,8 @@ from tqdm import tqdm
 import spacy
 import torch
 from spacy.matcher import PhraseMatcher
-from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
-from multiprocessing import cpu_count
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from multiprocessing import cpu_count, Value
 
 from scripts import cord_loader
 from scripts import downloader
@@ -22,6 +22,23 @@ from scripts import entity_merger
 from scripts import ner_main
 from scripts import analysis
 from scripts import pubmed_bulk
+from scripts import pretokenizer
+from scripts import incremental
+from scripts import cpu_budget
+from scripts import storage
+from scripts import manifest
+
+
+def get_result(future, shard, failed: list):
+    '''
+    result of a finished future. A failing shard is reported and collected in failed instead of stopping the run
+    '''
+    try:
+        return future.result()
+    except Exception as e:
+        print(f"ERROR! {shard} failed: {e!r}")
+        failed.append(shard)
+        return None
 
 
 def run_cord_loader(cord_loader_config: dict, ignore: bool):
@@ -49,6 +66,12 @@ def run_download(dl_config: dict, ignore: bool):
         input_file=dl_config["input_path"],
         output_file=dl_config["output_path"],
         batch_size=dl_config["batch_size"],
+        concurrency=dl_config.get("concurrency", 3),
+        requests_per_second=dl_config.get("requests_per_second", 0),
+        api_key=dl_config.get("api_key", ""),
+        email=dl_config.get("email", ""),
+        base_url=dl_config.get("base_url", downloader.EUTILS_URL),
+        max_retries=dl_config.get("max_retries", 5),
     )
     print("Finished running downloader script.")
     
@@ -73,7 +96,19 @@ def run_pubmed_bulk_loader(pbl_config: dict, ignore: bool):
     pubmed_bulk.run_pbl(pbl_config)
     
 
-def run_splitter(splitter_config: dict, ignore: bool) -> dict:
+def get_result_folders(splitter_config: dict, ner_config=None):
+    '''
+    result folders kept in sync by an incremental splitter run: the splitter output, "result_folders", and the
+    NER output folder when NER runs incrementally too (its outdated results must be purged, replaced batches re-tagged)
+    '''
+    folders = [splitter_config["output_folder"]] + splitter_config.get("result_folders", [])
+    if ner_config is not None and ner_config.get("incremental", False):
+        if os.path.normpath(ner_config["output_path"]) not in [os.path.normpath(folder) for folder in folders]:
+            folders.append(ner_config["output_path"])
+    return folders
+
+
+def run_splitter(splitter_config: dict, ignore: bool, ner_config=None) -> dict:
     if ignore:
         print("Ignoring script: splitter.")
         return {}
@@ -85,18 +120,38 @@ def run_splitter(splitter_config: dict, ignore: bool) -> dict:
             input_files_list = splitter_pubmed.load_pre_batched_files(splitter_config["input_path"])
         else:
             input_files_list = splitter_pubmed.load_pre_batched_files(splitter_config["input_path"], limit=splitter_config["file_limit"])
-            # split each batch
+
+        # incremental mode: only split (and later tag) articles that are new or changed since the last run
+        pmids_by_file = {input_file: None for input_file in input_files_list}
+        if splitter_config.get("incremental", False):
+            index = incremental.ArticleIndex(splitter_config["index_path"])
+            plan = incremental.plan_update(index, input_files_list, splitter_pubmed.get_batch_index)
+            incremental.purge_results(get_result_folders(splitter_config, ner_config),
+                                      plan["stale"], plan["replaced_batches"])
+            pmids_by_file = plan["pmids_by_file"]
+            input_files_list = list(pmids_by_file)
+
+        # resume: skip the files that were split before the last run stopped
+        if splitter_config.get("resume", False):
+            done = manifest.completed(splitter_config["output_folder"])
+            input_files_list = [input_file for input_file in input_files_list if os.path.basename(input_file) not in done]
+            print(f"Resuming splitter: {len(done)} files already split, {len(input_files_list)} to go")
+        else:
+            manifest.clear(splitter_config["output_folder"])
+        failed = []
+
+        # split each batch
         if splitter_config["tokenizer"] == 'spacy':
             print("Running splitter script with spacy")
             
-            with ProcessPoolExecutor(min(CPU_LIMIT,cpu_count())) as executor:
+            with ProcessPoolExecutor(min(CPU_LIMIT,cpu_count()), initializer=storage.configure, initargs=(IO_CONFIG,)) as executor:
                 
-                futures=[executor.submit(splitter_pubmed.split_prebatch,splitter_config, input_file,
-                    tokenizer="spacy") for input_file in input_files_list]
+                futures={executor.submit(splitter_pubmed.split_prebatch,splitter_config, input_file,
+                    tokenizer="spacy", pmids=pmids_by_file[input_file]): input_file for input_file in input_files_list}
                 
                 for future in as_completed(futures):
                     #print(future.result)
-                    i = future.result()
+                    i = get_result(future, futures[future], failed)
                     
                     
 
@@ -106,55 +161,161 @@ def run_splitter(splitter_config: dict, ignore: bool) -> dict:
             #import nltk
             #nltk.download("punkt")
             
-            with ProcessPoolExecutor(min(CPU_LIMIT,cpu_count())) as executor:
+            with ProcessPoolExecutor(min(CPU_LIMIT,cpu_count()), initializer=storage.configure, initargs=(IO_CONFIG,)) as executor:
                 
-                futures=[executor.submit(splitter_pubmed.split_prebatch,splitter_config,input_file,
-                    tokenizer="nltk") for input_file in input_files_list]
+                futures={executor.submit(splitter_pubmed.split_prebatch,splitter_config,input_file,
+                    tokenizer="nltk", pmids=pmids_by_file[input_file]): input_file for input_file in input_files_list}
                 
                 for future in as_completed(futures):
-                    i = future.result()
-        
+                    i = get_result(future, futures[future], failed)
 
+        elif splitter_config["tokenizer"] == 'rule':
+            print("Running splitter script with the rule-based segmenter")
 
-    else:        
-        with open(splitter_config["input_path"], "r",encoding="utf-8") as f:
-            full_articles = json.loads(f.read())
-
-        article_batches = splitter.make_batches(list(full_articles), splitter_config["batch_size"])
-
-        # split each batch
-        if splitter_config["tokenizer"] == 'spacy':
-            print("Running splitter script with spacy")
-            
-            with ProcessPoolExecutor(min(CPU_LIMIT,cpu_count())) as executor:
+            with ProcessPoolExecutor(min(CPU_LIMIT,cpu_count()), initializer=storage.configure, initargs=(IO_CONFIG,)) as executor:
                 
-                futures=[executor.submit(splitter.split_batch,splitter_config, idx, art, full_articles,
-                    tokenizer="spacy") for idx, art in enumerate(article_batches)]
+                futures={executor.submit(splitter_pubmed.split_prebatch,splitter_config,input_file,
+                    tokenizer="rule", pmids=pmids_by_file[input_file]): input_file for input_file in input_files_list}
                 
                 for future in as_completed(futures):
-                    #print(future.result)
-                    i = future.result()
-                    
-                    
+                    i = get_result(future, futures[future], failed)
 
-        elif splitter_config["tokenizer"] == 'nltk':
-            print("Running splitter script with nltk")
+        if splitter_config.get("incremental", False):
+            # the index is only updated once every planned file has been split
+            if len(failed) == 0:
+                index.update(plan["upserts"], plan["deletes"], plan["files"])
+            index.close()
 
-            #import nltk
-            #nltk.download("punkt")
+
+    else:
+        # parse the input incrementally and hand batches to the workers as soon as they are read.
+        # only a bounded number of batches is kept in flight so the full collection is never in memory
+        tokenizer = splitter_config["tokenizer"]
+        if tokenizer not in ["spacy", "nltk", "rule"]:
+            raise Exception("ERROR! Proper sentence splitter model not specified!")
+        print(f"Running splitter script with {tokenizer}")
+
+        # resume: skip the batches that were split before the last run stopped. Batches are numbered by their
+        # position in the input, so they only match the earlier run for the same input file and batch_size
+        input_stat = os.stat(splitter_config["input_path"])
+        run_params = {"input_path": os.path.abspath(splitter_config["input_path"]), "input_size": input_stat.st_size,
+                      "input_mtime": input_stat.st_mtime, "batch_size": splitter_config["batch_size"]}
+        recorded = None
+        completed = set()
+        if splitter_config.get("resume", False):
+            recorded = manifest.get_run(splitter_config["output_folder"])
+            if recorded is not None and recorded != run_params:
+                raise Exception(f"ERROR! Cannot resume the splitter: the input file or batch_size changed since the interrupted run "
+                                f"({recorded}). Set \"resume\" to false to split the input again")
+            completed = manifest.completed(splitter_config["output_folder"])
+        else:
+            manifest.clear(splitter_config["output_folder"])
+        if recorded is None:
+            manifest.mark_run(splitter_config["output_folder"], run_params)
+        failed = []
+
+        n_workers = min(CPU_LIMIT,cpu_count())
+        with ProcessPoolExecutor(n_workers, initializer=storage.configure, initargs=(IO_CONFIG,)) as executor:
             
-            with ProcessPoolExecutor(min(CPU_LIMIT,cpu_count())) as executor:
-                
-                futures=[executor.submit(splitter.split_batch,splitter_config,idx, art, full_articles,
-                    tokenizer="nltk") for idx, art in enumerate(article_batches)]
-                
-                for future in as_completed(futures):
-                    i = future.result()
+            futures = {}
+            for idx, art in enumerate(splitter.stream_batches(splitter_config["input_path"], splitter_config["batch_size"])):
+                if f"batch-{idx}" in completed:
+                    continue
+                if len(futures) >= 2*n_workers:
+                    done, pending = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        i = get_result(future, futures.pop(future), failed)
+
+                futures[executor.submit(splitter.split_batch,splitter_config,idx, art,
+                    tokenizer=tokenizer)] = f"batch-{idx}"
+            
+            for future in as_completed(futures):
+                i = get_result(future, futures[future], failed)
                 
 
+    if len(failed) > 0:
+        print(f"{len(failed)} splitter batches failed, set \"resume\" to true and run again to split them")
     print("Finished running splitter script.")
 
 
+def run_pretokenizer(pretokenizer_config: dict, ignore: bool):
+    if ignore:
+        print("Ignoring script: pretokenizer.")
+        return
+
+    print("Running pretokenizer script.")
+
+    input_file_list = storage.list_shards(pretokenizer_config["input_path"])
+
+    # each worker loads the tokenizer once and reuses it for every splitter output file
+    with ProcessPoolExecutor(min(CPU_LIMIT,cpu_count()), initializer=storage.configure, initargs=(IO_CONFIG,)) as executor:
+
+        futures=[executor.submit(pretokenizer.run_pretokenizer_file,pretokenizer_config,batch_file)
+                    for batch_file in input_file_list]
+
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            n = future.result()
+
+    print("Finished running pretokenizer script.")
+
+
+def run_ner_files(ner_config: dict, input_file_list: list, pipelined=False):
+    '''
+    tag a list of splitter files. Files that fail are reported and left out of the manifest
+    '''
+    if len(input_file_list) == 0:
+        return
+
+    if ner_config["multiprocessing"]:
+        # split the core budget into workers x threads, instead of every worker using every core
+        thread_plan = cpu_budget.plan_workers(CPU_LIMIT, ner_config.get("threads_per_worker", 1),
+                                              n_tasks=len(input_file_list), pin_cpus=ner_config.get("pin_cpus", False))
+        print(f"NER: {cpu_budget.describe_plan(thread_plan)}")
+        if ner_config.get("intra_op_threads", 0) == 0:
+            ner_config = {**ner_config, "intra_op_threads": thread_plan["threads"], "inter_op_threads": 1}
+
+        # each worker loads the model once in its initializer and reuses it for every batch file.
+        # the thread environment is only set while the pool runs, later stages get the default again
+        with cpu_budget.thread_env(thread_plan["threads"]), \
+                ProcessPoolExecutor(thread_plan["workers"], initializer=ner_main.init_worker,
+                                    initargs=(ner_config, -1, thread_plan, Value("i", 0), IO_CONFIG)) as executor:
+
+            if pipelined:
+                # one pipelined runner per worker over its share of the files, so reading, tokenization
+                # and writing overlap with inference
+                n_workers = thread_plan["workers"]
+                futures={executor.submit(ner_main.run_ner_pipelined,ner_config,input_file_list[w::n_workers]): f"worker {w}"
+                            for w in range(n_workers)}
+            else:
+                futures={executor.submit(ner_main.run_ner_main,ner_config,batch_file): batch_file
+                            for batch_file in input_file_list}
+            
+            failed = []
+            for future in as_completed(futures):
+                i = get_result(future, futures[future], failed)
+    else:
+        device=torch.device(0 if torch.cuda.is_available() else "cpu")
+        # a single process gets the whole core budget
+        thread_plan = cpu_budget.plan_workers(CPU_LIMIT, CPU_LIMIT, pin_cpus=False)
+        print(f"NER: {cpu_budget.describe_plan(thread_plan)}")
+        if ner_config.get("intra_op_threads", 0) == 0:
+            ner_config = {**ner_config, "intra_op_threads": thread_plan["threads"], "inter_op_threads": 1}
+
+        with cpu_budget.process_threads(thread_plan):
+            if pipelined:
+                # files the runner did not finish are left out of the manifest and retried by run_ner
+                try:
+                    ner_main.run_ner_pipelined(ner_config, input_file_list, device)
+                except Exception as e:
+                    print(f"ERROR! pipelined NER failed: {e!r}")
+            else:
+                for batch_file in tqdm(input_file_list):
+                    try:
+                        ner_main.run_ner_main(ner_config,batch_file, device)
+                    except Exception as e:
+                        print(f"ERROR! {batch_file} failed: {e!r}")
+
+
 def run_ner(ner_config: dict, ignore: bool):
 
     if ignore:
@@ -177,15 +338,18 @@ def run_ner(ner_config: dict, ignore: bool):
             # i += 1
         # articles = a
 
-    if ner_config.get("clear_old_results", True):
-        try:
-            os.remove(ner_config["output_path"])
-        except OSError:
-            pass
+    # remove the output files of a previous run (not the folder, which may hold other results).
+    # incremental mode keeps them, its filter below only tags the splitter files that have no output yet
+    if not ner_config.get("resume", False):
+        if ner_config.get("clear_old_results", True) and not ner_config.get("incremental", False):
+            for old_file in glob(f'{ner_config["output_path"]}/{ner_config["output_file_prefix"]}-*'):
+                if storage.get_format(old_file) is not None:
+                    os.remove(old_file)
+        manifest.clear(ner_config["output_path"])
     
     os.makedirs(ner_config["output_path"], exist_ok=True)
     
-    input_file_list = sorted(glob(f'{ner_config["input_path"]}*.json'), key=lambda x: int(os.path.splitext(os.path.basename(x))[0].split("-")[-1]))
+    input_file_list = storage.list_shards(ner_config["input_path"])
     
     # Sort files on range
     if "article_limit" in ner_config:
@@ -196,24 +360,39 @@ def run_ner(ner_config: dict, ignore: bool):
             input_file_list = ner_main.filter_files(input_file_list, start, end)
             
             print("processing articles between {} and {} range".format(start, end))
+
+    # incremental mode: only tag splitter files that have no NER output yet
+    if ner_config.get("incremental", False):
+        input_file_list = [batch_file for batch_file in input_file_list
+                           if not os.path.isfile(ner_main.get_output_file(ner_config, storage.get_shard_index(batch_file)))]
+        print(f"Incremental mode: {len(input_file_list)} new splitter files to tag")
+
+    # resume: skip the files that were tagged before the last run stopped
+    if ner_config.get("resume", False):
+        done = manifest.completed(ner_config["output_path"])
+        input_file_list = [batch_file for batch_file in input_file_list if os.path.basename(batch_file) not in done]
+        print(f"Resuming NER: {len(done)} files already tagged, {len(input_file_list)} to go")
     
 
 
     # Run prediction on each sentence in each article.
-    if ner_config["multiprocessing"]:
-        with ProcessPoolExecutor(min(CPU_LIMIT,cpu_count())) as executor:
-                
-            futures=[executor.submit(ner_main.run_ner_main,ner_config,batch_file)
-                        for batch_file in input_file_list]
-            
-            for future in as_completed(futures):
-                i = future.result()
-    else:
-        device=torch.device(0 if torch.cuda.is_available() else "cpu")
-
-        for batch_file in tqdm(input_file_list):
-            ner_main.run_ner_main(ner_config,batch_file, device)
-            
+    run_ner_files(ner_config, input_file_list, pipelined=ner_config.get("pipelined", False))
+
+    # retry the files that failed (e.g. out of memory) with half the batch size each time
+    batch_size = ner_config.get("batch_size", 32)
+    for attempt in range(ner_config.get("max_retries", 2)):
+        done = manifest.completed(ner_config["output_path"])
+        failed = [batch_file for batch_file in input_file_list if os.path.basename(batch_file) not in done]
+        if len(failed) == 0:
+            break
+        batch_size = max(1, batch_size//2)
+        print(f"Retrying {len(failed)} failed files with batch_size {batch_size}")
+        run_ner_files({**ner_config, "batch_size": batch_size}, failed, pipelined=False)
+
+    done = manifest.completed(ner_config["output_path"])
+    failed = [batch_file for batch_file in input_file_list if os.path.basename(batch_file) not in done]
+    if len(failed) > 0:
+        print(f"{len(failed)} files could not be tagged, set \"resume\" to true and run again to retry them: {failed}")
 
     print("Finished running NER script.")
 
@@ -272,6 +451,10 @@ if __name__ == "__main__":
     CPU_LIMIT=config["CPU_LIMIT"]  #for multiprocessing
     print(f"Limited to {CPU_LIMIT} CPUs")
 
+    # json codec and compression of every stage, also set in each worker process
+    IO_CONFIG=config.get("io", {})
+    storage.configure(IO_CONFIG)
+
 
     # Load abstracts from the CORD dataset.
     run_cord_loader(config["cord_loader"], ignore=ignore["cord_loader"])
@@ -290,7 +473,11 @@ if __name__ == "__main__":
     print()
 
     # Extract sentences from each article.
-    run_splitter(config["splitter"], ignore=ignore["splitter"])
+    run_splitter(config["splitter"], ignore=ignore["splitter"], ner_config=config["ner"])
+    print()
+
+    # Tokenize the splitter output once for the BioBERT models.
+    run_pretokenizer(config["pretokenizer"], ignore=ignore.get("pretokenizer", True))
     print()
 
     # Run NER inference on each sentence for each article.
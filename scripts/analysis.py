@@ -7,12 +7,13 @@ from tqdm import tqdm
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
+from . import storage
 
 def get_input_files(input_folder_path):
     '''
-    get all NER result files within the given input folder in a sorted list
+    get all NER result files (json or parquet) within the given input folder in a sorted list
     '''
-    return sorted(glob(f'{input_folder_path}*.json'), key=lambda x: int(os.path.splitext(os.path.basename(x))[0].split("-")[-1]))
+    return storage.list_shards(input_folder_path)
 
 
 def run_analysis(input_files_list):
@@ -28,12 +29,11 @@ def run_analysis(input_files_list):
         
         #check for file naming errors
         try:
-            idx = int(os.path.splitext(os.path.basename(batch))[0].split("-")[-1])
+            idx = storage.get_shard_index(batch)
         except:
             raise Exception("Error! NER files do not contain index in the end. Add index to the designated files.")
 
-        with open(batch, encoding="utf8") as f:
-            articles = json.loads(f.read())
+        articles = storage.read_shard(batch, tokens=False)
         
         count_articles+=len(articles)
         #Loop over articles    
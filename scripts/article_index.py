@@ -0,0 +1,176 @@
+# coding=utf-8
+## PMID -> shard index of the splitter, NER and merger output. Every writer records where it put each article
+## (shard file, and for uncompressed json and jsonl shards the byte range of the article), so single articles can be
+## read without parsing whole shards. Run from the repository root, for example:
+## python -m scripts.article_index -i results/index/articles.sqlite -p 36012345
+## python -m scripts.article_index -i results/index/articles.sqlite --build results/splitter/ results/ner/
+
+import os
+import json
+import sqlite3
+import argparse
+import threading
+from tqdm import tqdm
+from . import storage
+
+
+def get_stage(output_folder: str):
+    '''
+    stage name of an output folder, the articles of every output folder are indexed separately
+    '''
+    return os.path.normpath(output_folder)
+
+
+class ArticleIndex:
+
+    def __init__(self, db_path: str):
+        '''
+        (stage, pmid) -> (shard, offset, length), offset is -1 for shards without byte ranges (parquet, compressed json).
+        SQLite, safe to share between worker processes and between the threads of a process
+        (e.g. the writer thread of pipelined NER and a later retry pass), calls are serialized by a lock
+        '''
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=600, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS locations (
+                                 stage TEXT NOT NULL,
+                                 pmid TEXT NOT NULL,
+                                 shard TEXT NOT NULL,
+                                 offset INTEGER NOT NULL,
+                                 length INTEGER NOT NULL,
+                                 PRIMARY KEY (stage, pmid)
+                             ) WITHOUT ROWID""")
+        self.conn.commit()
+
+    def add_shard(self, stage: str, shard: str, pmids: list, locations=None):
+        '''
+        record the articles written to a shard
+        locations: dict of pmid -> [offset, length] returned by storage.write_shard, or None
+        '''
+        locations = locations or {}
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO locations (stage, pmid, shard, offset, length) VALUES (?, ?, ?, ?, ?)",
+                                  [(stage, str(pmid), shard, *locations.get(str(pmid), [-1, -1])) for pmid in pmids])
+
+    def lookup(self, pmid: str, stage=None):
+        '''
+        returns list of (stage, shard, offset, length) of an article, in every indexed stage or in one
+        '''
+        with self.lock:
+            if stage is None:
+                rows = self.conn.execute("SELECT stage, shard, offset, length FROM locations WHERE pmid = ? ORDER BY stage", (str(pmid),))
+            else:
+                rows = self.conn.execute("SELECT stage, shard, offset, length FROM locations WHERE pmid = ? AND stage = ?",
+                                         (str(pmid), get_stage(stage)))
+            return list(rows)
+
+    def stages(self):
+        with self.lock:
+            return [stage for stage, in self.conn.execute("SELECT DISTINCT stage FROM locations ORDER BY stage")]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def read_article(shard: str, pmid: str, offset: int, length: int):
+    '''
+    read one article from a shard, using its byte range when there is one. Falls back to reading the whole shard
+    when the range is unknown or outdated (e.g. the shard was rewritten by an incremental update)
+
+    returns the article, None if the shard no longer has it
+    '''
+    if not os.path.isfile(shard):
+        return None
+
+    if offset >= 0:
+        try:
+            if shard.endswith(".jsonl"):
+                with open(shard, "rb") as f:
+                    f.seek(offset)
+                    key, article = storage.loads(f.read(length))
+            else:
+                key, article = storage.read_json_entry(shard, offset, length)
+            if key == str(pmid):
+                return article
+        except (ValueError, TypeError, StopIteration):
+            pass
+
+    return storage.read_shard(shard).get(str(pmid), None)
+
+
+def fetch(index: ArticleIndex, pmid: str, stage=None):
+    '''
+    returns dict of stage -> article for an article in every indexed stage (or in one)
+    '''
+    articles = {}
+    for article_stage, shard, offset, length in index.lookup(pmid, stage):
+        article = read_article(shard, pmid, offset, length)
+        if article is not None:
+            articles[article_stage] = article
+
+    return articles
+
+
+def build_index(index: ArticleIndex, folders: list):
+    '''
+    index shards that were written without the article index. jsonl shards get byte ranges from their footer,
+    other shards are listed with offset -1 (read whole on lookup)
+    '''
+    for folder in folders:
+        stage = get_stage(folder)
+        for shard in tqdm(storage.list_shards(os.path.join(folder, "")), desc=f"indexing {stage}"):
+            if shard.endswith(".jsonl"):
+                locations = storage.scan_jsonl(shard)[0]
+                index.add_shard(stage, shard, list(locations), locations)
+            else:
+                index.add_shard(stage, shard, list(storage.read_shard(shard)))
+
+
+# open indexes in this process, keyed by database path
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def open_index(db_path: str):
+    with _indexes_lock:
+        if db_path not in _indexes:
+            _indexes[db_path] = ArticleIndex(db_path)
+        return _indexes[db_path]
+
+
+def record_shard(db_path: str, output_folder: str, shard: str, articles: dict, locations=None):
+    '''
+    record a shard written by a pipeline stage, does nothing if no index is configured ("")
+    '''
+    if not db_path:
+        return
+    # a merged json rewrite returns the locations of every article in the shard
+    pmids = list(locations) if locations else list(articles)
+    open_index(db_path).add_shard(get_stage(output_folder), shard, pmids, locations)
+
+
+if __name__ == "__main__":
+
+    description = "Fetch single articles from the splitter, NER and merger output through the article index"
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('-i', "--index_path", type=str, required=True,
+                        help="article index file, e.g. results/index/articles.sqlite")
+    parser.add_argument('-p', "--pmids", type=str, nargs="*", required=False, default=[],
+                        help="article IDs to fetch")
+    parser.add_argument('-s', "--stage", type=str, required=False, default=None,
+                        help="output folder to fetch from, all indexed folders if not given")
+    parser.add_argument("--build", type=str, nargs="*", required=False, default=[],
+                        help="output folders to index (for output written without the index)")
+
+    args = parser.parse_args()
+
+    index = ArticleIndex(args.index_path)
+    if len(args.build) > 0:
+        build_index(index, args.build)
+
+    for pmid in args.pmids:
+        print(json.dumps({pmid: fetch(index, pmid, args.stage)}, indent=2, ensure_ascii=False))
+
+    index.close()
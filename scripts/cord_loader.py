@@ -7,8 +7,8 @@
 import os
 import csv
 import hashlib
-import json
 from tqdm import tqdm
+from . import storage
 
 
 def run(input_file: str, output_file: str, subset: bool, subset_file: str):
@@ -99,8 +99,7 @@ def run(input_file: str, output_file: str, subset: bool, subset_file: str):
                     "url": url,
                 }
 
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(result, f, ensure_ascii=False, indent=2)
+    storage.write_json(output_file, result)
 
 
 '''
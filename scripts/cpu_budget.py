@@ -0,0 +1,125 @@
+# coding=utf-8
+## CPU budget for worker pools: split a total number of cores into workers x threads per worker and pin the
+## thread pools of torch, BLAS, tokenizers and ONNX Runtime in each worker so that workers do not oversubscribe the node
+
+import os
+from contextlib import contextmanager
+from multiprocessing import cpu_count
+
+_THREAD_ENV_VARS = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS"]
+
+
+def available_cpus():
+    '''
+    cpus this process may run on (respects taskset/cgroup affinity where the platform supports it)
+    '''
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(cpu_count()))
+
+
+def plan_workers(cpu_limit: int, threads_per_worker=1, n_tasks=None, pin_cpus=False):
+    '''
+    split the core budget into worker processes and threads per worker
+    cpu_limit: total number of cores to use
+    threads_per_worker: intra-op threads of each worker
+    n_tasks: optional number of tasks (e.g. batch files), no more workers than tasks are started
+
+    returns dict with total_cpus, workers, threads, cpus and pin_cpus
+    '''
+    cpus = available_cpus()
+    total = max(1, min(cpu_limit, len(cpus)))
+    threads = max(1, min(threads_per_worker, total))
+    workers = max(1, total // threads)
+    if n_tasks is not None:
+        workers = max(1, min(workers, n_tasks))
+
+    return {"total_cpus": total,
+            "workers": workers,
+            "threads": threads,
+            "cpus": cpus[:total],
+            "pin_cpus": pin_cpus}
+
+
+def describe_plan(plan: dict):
+    pinning = "pinned to cpus" if plan["pin_cpus"] else "not pinned"
+    return (f'{plan["workers"]} worker(s) x {plan["threads"]} thread(s) = {plan["workers"]*plan["threads"]} '
+            f'of {plan["total_cpus"]} cores, {pinning}')
+
+
+def set_thread_env(threads: int):
+    '''
+    thread pool sizes for libraries that read them from the environment when they start
+    (set in the parent before the pool is created so that spawned workers inherit them)
+    '''
+    for var in _THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+    # the rust tokenizers would otherwise start their own thread pool in every worker
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+
+@contextmanager
+def thread_env(threads: int):
+    '''
+    set_thread_env for the duration of a with block, e.g. around creating a worker pool.
+    The previous environment is restored afterwards so later stages do not inherit the worker limits
+    '''
+    saved = {var: os.environ.get(var) for var in _THREAD_ENV_VARS + ["TOKENIZERS_PARALLELISM"]}
+    set_thread_env(threads)
+    try:
+        yield
+    finally:
+        for var, value in saved.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
+
+@contextmanager
+def process_threads(plan: dict):
+    '''
+    thread limits of a plan for work run in the current process (no worker pool), restored afterwards
+    '''
+    try:
+        import torch
+    except ImportError:
+        torch = None
+
+    with thread_env(plan["threads"]):
+        if torch is not None:
+            saved_threads = torch.get_num_threads()
+            torch.set_num_threads(plan["threads"])
+        try:
+            yield
+        finally:
+            if torch is not None:
+                torch.set_num_threads(saved_threads)
+
+
+def init_worker_threads(plan: dict, slot_counter=None):
+    '''
+    pin the thread counts (and optionally the cpus) of the current worker process
+    slot_counter: multiprocessing.Value shared by the workers of a pool, gives each worker its own cpu slice
+    '''
+    threads = plan["threads"]
+    set_thread_env(threads)
+
+    try:
+        import torch
+        torch.set_num_threads(threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # can only be set once, before any parallel work in this process
+            pass
+    except ImportError:
+        pass
+
+    if plan["pin_cpus"] and slot_counter is not None and hasattr(os, "sched_setaffinity"):
+        with slot_counter.get_lock():
+            slot = slot_counter.value
+            slot_counter.value += 1
+        cpus = plan["cpus"]
+        start = (slot*threads) % len(cpus)
+        os.sched_setaffinity(0, cpus[start:start+threads] or cpus)
@@ -1,13 +1,24 @@
 # coding=utf-8
 
-import json
+import argparse
 import os
 import pubmed_parser as pp
+import re
 import requests
-import shutil
-import sys
+import tempfile
+import threading
+import time
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from typing import Any, List
+from . import storage, util
+
+
+# NCBI eFetch utility, see here: https://www.ncbi.nlm.nih.gov/books/NBK25499/
+EUTILS_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
+
+# responses that are worth retrying: rate limited or a temporary server error
+RETRY_STATUS = {429, 500, 502, 503, 504}
 
 
 def _make_batches(xs: List[Any], size: int):
@@ -15,47 +26,123 @@ def _make_batches(xs: List[Any], size: int):
         yield xs[i:i+size]
 
 
-def _run(input_file: str, output_file: str, batch_size: int):
-    lines = []
-    for line in open(input_file, "r"):
-        lines.append(line.strip())
-
-    pmid_batches = []
-    for batch in _make_batches(lines, batch_size):
-        pmid_batches.append(batch)
+def get_parts_file(output_file: str):
+    '''
+    append-only file the downloaded batches are collected in, when the output file itself is not jsonl
+    '''
+    return output_file if output_file.endswith(".jsonl") else output_file + ".parts.jsonl"
+
+
+def get_rate(requests_per_second: float = 0, api_key: str = ""):
+    '''
+    NCBI allows 3 requests/s per IP address, 10 requests/s with an API key. A positive requests_per_second overrides the default
+    '''
+    if requests_per_second and requests_per_second > 0:
+        return requests_per_second
+    return 10 if api_key else 3
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, capacity: float = 1):
+        '''
+        thread-safe token bucket, acquire() blocks until a request may be sent.
+        The capacity of 1 spaces requests evenly instead of allowing a burst at the start of every second
+        '''
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+def new_session(pool_size: int):
+    '''
+    HTTP session with a connection pool large enough for all requests in flight, connections are kept alive between batches
+    '''
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _build_api_url(pmid_list: List[str], retmode="xml", base_url=EUTILS_URL, api_key="", email=""):
+# builds the URL to be used with the NCBI eFetch utility, can also be used for other NCBI databases
+# see here: https://www.ncbi.nlm.nih.gov/books/NBK25499/
+    url = "{}?db=pubmed&id={}&retmode={}&rettype=abstract".format(base_url, ",".join(pmid_list), retmode)
+    if api_key:
+        url += "&api_key={}".format(api_key)
+    if email:
+        url += "&tool=EasyNER&email={}".format(email)
+    return url
 
-    i = 0
-    n = 0
-    for pmid_batch in pmid_batches:
-        i += 1
-        n += len(pmid_batch)
-        print("Downloading and saving batch {}...".format(i))
 
-        api_url = _build_api_url(pmid_batch, retmode="xml")
-        new_data = _download_data(api_url)
-        _append_json(output_file, new_data)
+def _redact_url(api_url: str):
+    # the API key is a credential, keep it out of logs
+    return re.sub(r"api_key=[^&]*", "api_key=***", api_url)
 
-        print("Saved {}/{} articles so far.\n".format(n, len(lines)))
 
+def _get_retry_delay(res, attempt: int, backoff: float):
+    # the server tells how long to wait (429/503), otherwise exponential backoff
+    retry_after = res.headers.get("Retry-After", "") if res is not None else ""
+    try:
+        return max(float(retry_after), 0)
+    except ValueError:
+        return min(backoff * 2 ** attempt, 60)
 
-def _build_api_url(pmid_list: List[str], retmode="xml"):
-# builds the URL to be used with the NCBI eFetch utility, can also be used for other NCBI databases
-# see here: https://www.ncbi.nlm.nih.gov/books/NBK25499/
-    return ("https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
-            "?db=pubmed&id={}&retmode={}&rettype=abstract"
-            ).format(",".join(pmid_list), retmode)
 
+def _parse_medline(content: bytes):
+    '''
+    parse an eFetch response in memory (pubmed_parser reads an XML string when it is not a path),
+    through a temporary file of its own for pubmed_parser versions that need a path
+    '''
+    try:
+        return pp.parse_medline_xml(content)
+    except (TypeError, AttributeError, OSError, ValueError):
+        with tempfile.NamedTemporaryFile(suffix=".xml") as f:
+            f.write(content)
+            f.flush()
+            return pp.parse_medline_xml(f.name)
 
-def _download_data(api_url: str):
-    res = requests.get(api_url)
-    if res.status_code != 200:
-        print (api_url)
-        raise requests.HTTPError(res.reason)
 
-    with open("{}/medline.xml".format(_tmp_dir), "w",encoding="utf-8") as f:
-        f.write(res.text)
+def _download_data(api_url: str, session=None, bucket=None, max_retries: int = 0, backoff: float = 1, timeout: float = 120):
+    session = session or requests
+    attempt = 0
+    while True:
+        if bucket is not None:
+            bucket.acquire()
 
-    medline_json_list = pp.parse_medline_xml("{}/medline.xml".format(_tmp_dir))
+        try:
+            res = session.get(api_url, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt >= max_retries:
+                # the message of a connection error holds the URL
+                raise type(e)(_redact_url(str(e))) from None
+            res = None
+        else:
+            if res.status_code == 200:
+                break
+            if res.status_code not in RETRY_STATUS or attempt >= max_retries:
+                print (_redact_url(api_url))
+                raise requests.HTTPError(res.reason)
+
+        time.sleep(_get_retry_delay(res, attempt, backoff))
+        attempt += 1
+
+    medline_json_list = _parse_medline(res.content)
 
     # Map PMID to article
     new_data = {}
@@ -65,33 +152,115 @@ def _download_data(api_url: str):
     return new_data
 
 
-def _append_json(path: str, new_data: dict):
-    if not os.path.isfile(path):
-        with open(path, "w", encoding="utf-8") as f:
-            f.write("{}")
+def get_downloaded_pmids(output_file: str):
+    '''
+    PMIDs already in the output: in the parts file of an interrupted run and in the JSON output of an earlier run
+    '''
+    pmids = set()
+    parts_file = get_parts_file(output_file)
+    if os.path.isfile(parts_file):
+        pmids.update(storage.scan_jsonl(parts_file)[0])
+    if parts_file != output_file and os.path.isfile(output_file):
+        pmids.update(pmid for pmid, _ in util.iter_json_dict(output_file, opener=storage.open_file))
+    return pmids
+
 
-    with open(path, "r", encoding="utf-8") as f:
-        old_data = json.loads(f.read())
+def _run(input_file: str, output_file: str, batch_size: int, concurrency: int = 3, requests_per_second: float = 0,
+         api_key: str = "", email: str = "", base_url: str = EUTILS_URL, max_retries: int = 5):
+    lines = []
+    for line in open(input_file, "r"):
+        if line.strip() != "":
+            lines.append(line.strip())
 
-    data = {**old_data, **new_data}  # Merge dicts (new overwrites old)
+    unique = list(dict.fromkeys(lines))
+    downloaded = get_downloaded_pmids(output_file)
+    pmids = [pmid for pmid in unique if pmid not in downloaded]
+    print("{} PMIDs in input, {} already downloaded, {} to download.".format(len(unique), len(unique) - len(pmids), len(pmids)))
 
-    with open(path, "w", encoding="utf-8") as f:
-        f.write(json.dumps(data, indent=2, ensure_ascii=False))
+    pmid_batches = list(_make_batches(pmids, batch_size))
+    if len(pmid_batches) == 0:
+        return
 
+    rate = get_rate(requests_per_second, api_key)
+    print("Downloading {} batches, {} requests in flight, at most {} requests/s.\n".format(len(pmid_batches), concurrency, rate))
 
-_tmp_dir = "tmp_dir_dl"
+    session = new_session(concurrency)
+    bucket = TokenBucket(rate)
 
+    def download(pmid_batch):
+        api_url = _build_api_url(pmid_batch, retmode="xml", base_url=base_url, api_key=api_key, email=email)
+        return _download_data(api_url, session=session, bucket=bucket, max_retries=max_retries)
 
-def run(input_file: str, output_file: str, batch_size: int):
-    os.makedirs(_tmp_dir, exist_ok=True)
-    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    i = 0
+    n = 0
+    batches = iter(pmid_batches)
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        # batches are appended by this thread only, as they finish, the footer index is written once at the end
+        # (or read back from the records after a crash)
+        with storage.JsonlAppender(get_parts_file(output_file)) as appender:
+            pending = {}
+            while True:
+                # keep a few batches queued per worker, without submitting the whole input at once
+                while len(pending) < 2 * concurrency:
+                    pmid_batch = next(batches, None)
+                    if pmid_batch is None:
+                        break
+                    pending[executor.submit(download, pmid_batch)] = pmid_batch
+                if len(pending) == 0:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pmid_batch = pending.pop(future)
+                    appender.append(future.result())
+                    i += 1
+                    n += len(pmid_batch)
+                    print("Saved batch {}/{}, {}/{} articles so far.".format(i, len(pmid_batches), n, len(pmids)))
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        session.close()
+
+
+def _write_json(parts_file: str, path: str):
+    '''
+    write the downloaded articles to the JSON output file, merged with the articles already in it (new overwrite old).
+    Both files are streamed, only the PMIDs are kept in memory
+    '''
+    new_pmids = set(storage.scan_jsonl(parts_file)[0])
+
+    def items():
+        if os.path.isfile(path):
+            for pmid, article in util.iter_json_dict(path, opener=storage.open_file):
+                if pmid not in new_pmids:
+                    yield pmid, article
+        yield from storage.iter_jsonl(parts_file)
+
+    tmp_path = path + ".tmp"
+    with storage.open_file(tmp_path, "wb", compression=storage.get_compression(path)) as f:
+        storage.write_json_items(f, items())
+    os.replace(tmp_path, path)
+    os.remove(parts_file)
+
+
+def run(input_file: str, output_file: str, batch_size: int, concurrency: int = 3, requests_per_second: float = 0,
+        api_key: str = "", email: str = "", base_url: str = EUTILS_URL, max_retries: int = 5):
+    '''
+    download the articles of a list of PMIDs. Runs are resumable: PMIDs already in the output are skipped
+    concurrency: number of requests in flight, their rate is limited to requests_per_second (0: NCBI's limit, see get_rate)
+    base_url: eFetch URL, e.g. a local server standing in for NCBI
+    '''
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
 
     try:
-        _run(input_file, output_file, batch_size)
+        _run(input_file, output_file, batch_size, concurrency=concurrency, requests_per_second=requests_per_second,
+             api_key=api_key, email=email, base_url=base_url, max_retries=max_retries)
     except KeyboardInterrupt:
         pass
 
-    shutil.rmtree(_tmp_dir)
+    parts_file = get_parts_file(output_file)
+    if parts_file != output_file and os.path.isfile(parts_file):
+        _write_json(parts_file, output_file)
 
 
 """
@@ -99,32 +268,37 @@ def run(input_file: str, output_file: str, batch_size: int):
 Get research paper abstracts from list of PMIDs.
 Arguments:
     input_file - path to .txt file with list of newline-separated PMIDs.
-    batch_size - how many articles to download each API call (default: 10).
+    batch_size - how many articles to download each API call (default: 400).
 ———————————————————————————————————————————————————————————————————————————————
 """
 if __name__ == "__main__":
 
-    if len(sys.argv) < 3 or len(sys.argv) > 4:
-        sys.exit(
-            "usage: {} input_path output_path [batch_size]".format(sys.argv[0]))
-
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
-    batch_size = 400
-
-    if len(sys.argv) == 4:
-        try:
-            batch_size = int(sys.argv[3])
-        except ValueError:
-            sys.exit("error: batch_size must be an integer")
-
-    print("input_file  = {}".format(input_file))
-    print("output_file = {}".format(output_file))
-    print("batch_size  = {}".format(batch_size))
+    parser = argparse.ArgumentParser(description="Get research paper abstracts from list of PMIDs")
+    parser.add_argument("input_path", type=str, help="path to .txt file with list of newline-separated PMIDs")
+    parser.add_argument("output_path", type=str, help="path to the JSON (or .jsonl) output file")
+    parser.add_argument("batch_size", type=int, nargs="?", default=400, help="how many articles to download each API call")
+    parser.add_argument("--concurrency", type=int, default=3, help="number of requests in flight")
+    parser.add_argument("--requests_per_second", type=float, default=0, help="rate limit, 0: 3/s, or 10/s with an API key")
+    parser.add_argument("--api_key", type=str, default="", help="NCBI API key")
+    parser.add_argument("--email", type=str, default="", help="contact e-mail sent to NCBI with every request")
+    parser.add_argument("--base_url", type=str, default=EUTILS_URL, help="eFetch URL")
+    parser.add_argument("--max_retries", type=int, default=5, help="retries per batch on rate limiting and server errors")
+
+    args = parser.parse_args()
+
+    print("input_file  = {}".format(args.input_path))
+    print("output_file = {}".format(args.output_path))
+    print("batch_size  = {}".format(args.batch_size))
     print()
 
     run(
-        input_file=input_file,
-        output_file=output_file,
-        batch_size=batch_size
+        input_file=args.input_path,
+        output_file=args.output_path,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        requests_per_second=args.requests_per_second,
+        api_key=args.api_key,
+        email=args.email,
+        base_url=args.base_url,
+        max_retries=args.max_retries
     )
@@ -5,16 +5,16 @@ import os
 import re
 from tqdm import tqdm, trange
 from glob import glob
+from . import article_index, storage
 
 def read_articles(filename:str):
-    with open(filename, encoding="utf-8") as f:
-        return json.loads(f.read())
+    return storage.read_shard(filename)
 
 def get_sorted_files(filepath):
     '''
-    get a list of sorted file paths using glob
+    get a list of sorted file paths (json or parquet) using glob
     '''
-    return sorted(glob(f'{filepath}*.json'), key=lambda x: int(os.path.splitext(os.path.basename(x))[0].split("-")[-1]))
+    return storage.list_shards(filepath)
 
 
 def process_articles(articles: dict, entity_tag:str):
@@ -56,9 +56,10 @@ def merge_two_articles(articles_1, articles_2):
                     
     return articles_1
 
-def entity_merger(paths:list, entities:list, output_file:str):
+def entity_merger(paths:list, entities:list, output_file:str, index_path=""):
     '''
     merge same files
+    index_path: article index to record the merged articles in ("" for none)
     '''
     
     merged_entities = {}
@@ -73,8 +74,8 @@ def entity_merger(paths:list, entities:list, output_file:str):
         #merge entities
         merged_entities=merge_two_articles(merged_entities, processed_ner_article)
     
-    with open(output_file, "w", encoding="utf-8") as f:
-        f.write(json.dumps(merged_entities, indent=2, ensure_ascii=False))
+    locations = storage.write_shard(output_file, merged_entities)
+    article_index.record_shard(index_path, os.path.dirname(output_file), output_file, merged_entities, locations)
         
     return
 
@@ -95,9 +96,10 @@ def run_entity_merger(merger_config: dict):
     
     for i in trange(len(file_lists[entities[0]])):
         processed_paths = [file_lists[j][i] for j in entities]
-        output_file = output_folder+output_prefix + str(get_batch_no_from_filename(processed_paths[0])) +".json"
+        output_file = output_folder+output_prefix + str(get_batch_no_from_filename(processed_paths[0])) + storage.get_extension(merger_config.get("output_format", "json"))
 
-        entity_merger(paths=processed_paths, entities=entities,output_file=output_file)
+        entity_merger(paths=processed_paths, entities=entities,output_file=output_file,
+                      index_path=merger_config.get("article_index", ""))
         
     return 
     
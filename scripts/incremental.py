@@ -0,0 +1,199 @@
+# coding=utf-8
+## Incremental processing of PubMed update files. A persistent SQLite index records the hash and batch of every
+## article that went through splitting and NER, so that only new or changed articles are split and tagged again
+## and DeleteCitation removals are applied to the stored results
+
+import os
+import json
+import sqlite3
+import hashlib
+from tqdm import tqdm
+from . import storage, util
+
+
+def get_article_hash(article: dict):
+    '''
+    hash of the article fields the splitter and NER depend on
+    '''
+    h = hashlib.sha256()
+    h.update(str(article.get("title", "")).encode("utf-8"))
+    h.update(b"\n")
+    h.update(str(article.get("abstract", "")).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def get_deleted_file(json_file: str):
+    '''
+    sidecar file with the DeleteCitation PMIDs of a converted pubmed file
+    '''
+    return os.path.join(os.path.dirname(json_file), storage.strip_extension(json_file) + ".deleted.txt")
+
+
+def get_file_stats(path: str):
+    '''
+    (modification time, size) of an input file, a file is planned again when either changes
+    '''
+    stat = os.stat(path)
+    return (stat.st_mtime, stat.st_size)
+
+
+def read_deleted_pmids(json_file: str):
+    deleted_file = get_deleted_file(json_file)
+    if not os.path.isfile(deleted_file):
+        return []
+    with open(deleted_file, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if len(line.strip()) > 0]
+
+
+class ArticleIndex:
+
+    def __init__(self, db_path: str):
+        '''
+        pmid -> (hash, batch index) of the articles that have been processed
+        '''
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(db_path, timeout=600)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS articles (
+                                 pmid TEXT PRIMARY KEY,
+                                 hash TEXT NOT NULL,
+                                 batch_index INTEGER NOT NULL
+                             )""")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS input_files (
+                                 path TEXT PRIMARY KEY,
+                                 mtime REAL NOT NULL,
+                                 size INTEGER NOT NULL
+                             )""")
+        self.conn.commit()
+
+    def get_many(self, pmids: list, chunk_size=500):
+        '''
+        returns dict of pmid -> (hash, batch index) for the pmids found in the index
+        '''
+        found = {}
+        for start in range(0, len(pmids), chunk_size):
+            chunk = pmids[start:start+chunk_size]
+            rows = self.conn.execute(f"SELECT pmid, hash, batch_index FROM articles WHERE pmid IN ({','.join('?'*len(chunk))})", chunk)
+            for pmid, article_hash, batch_index in rows:
+                found[pmid] = (article_hash, batch_index)
+
+        return found
+
+    def get_files(self):
+        '''
+        returns dict of input file -> (mtime, size) of the input files that have been processed
+        '''
+        return {path: (mtime, size) for path, mtime, size in self.conn.execute("SELECT path, mtime, size FROM input_files")}
+
+    def update(self, upserts: dict, deletes: list, files={}):
+        '''
+        upserts: dict of pmid -> (hash, batch index)
+        deletes: list of pmids to remove
+        files: dict of input file -> (mtime, size) of the input files the update was planned from
+        '''
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO input_files (path, mtime, size) VALUES (?, ?, ?)",
+                                  [(path, mtime, size) for path, (mtime, size) in files.items()])
+            self.conn.executemany("INSERT OR REPLACE INTO articles (pmid, hash, batch_index) VALUES (?, ?, ?)",
+                                  [(pmid, article_hash, batch_index) for pmid, (article_hash, batch_index) in upserts.items()])
+            self.conn.executemany("DELETE FROM articles WHERE pmid = ?", [(pmid,) for pmid in deletes])
+
+    def close(self):
+        self.conn.close()
+
+
+def plan_update(index: ArticleIndex, input_files: list, get_batch_index):
+    '''
+    compare the articles of the input files (in update order) against the index. Only files that are new or
+    modified since the last run are read (streamed), the articles of the others are already in the index
+    input_files: converted pubmed json files, later files supersede earlier ones
+    get_batch_index: function returning the batch index of an input file
+
+    returns dict with
+        pmids_by_file: input file -> pmids to split and tag (files without any are left out)
+        replaced_batches: batch indices that already have results and are split again as a whole
+        stale: batch index -> pmids whose stored results are outdated or deleted
+        upserts, deletes, files: index changes to commit once the update has been processed
+    '''
+    known_files = index.get_files()
+    files = {os.path.abspath(f): get_file_stats(f) for f in input_files}
+    new_files = [f for f in input_files if known_files.get(os.path.abspath(f)) != files[os.path.abspath(f)]]
+    print(f"Incremental update: {len(new_files)} new or modified input files, {len(input_files)-len(new_files)} unchanged")
+
+    latest = {}     # pmid -> (hash, input file) of the newest version
+    deleted = set()
+
+    for input_file in tqdm(new_files, desc="planning incremental update"):
+        for pmid, article in util.iter_json_dict(input_file, opener=storage.open_file):
+            latest[pmid] = (get_article_hash(article), input_file)
+            deleted.discard(pmid)
+        for pmid in read_deleted_pmids(input_file):
+            latest.pop(pmid, None)
+            deleted.add(pmid)
+
+    indexed = index.get_many(list(latest) + list(deleted))
+
+    # a modified file does not supersede articles whose indexed version comes from a later, unchanged file
+    position = {get_batch_index(f): i for i, f in enumerate(input_files)}
+    unchanged_batches = {get_batch_index(f) for f in input_files if f not in new_files}
+    for pmid, (article_hash, input_file) in list(latest.items()):
+        if pmid in indexed and indexed[pmid][1] in unchanged_batches and \
+                position[indexed[pmid][1]] > position[get_batch_index(input_file)]:
+            del latest[pmid]
+
+    changed = {pmid for pmid, (article_hash, input_file) in latest.items()
+               if pmid not in indexed or indexed[pmid][0] != article_hash}
+    # a batch that already has stored results is split again as a whole, so its output files stay complete
+    indexed_batches = {batch_index for article_hash, batch_index in indexed.values()}
+    changed_files = {latest[pmid][1] for pmid in changed}
+    replaced_files = {input_file for input_file in changed_files if get_batch_index(input_file) in indexed_batches}
+
+    pmids_by_file = {}
+    stale = {}
+    upserts = {}
+    for pmid, (article_hash, input_file) in latest.items():
+        if pmid not in changed and input_file not in replaced_files:
+            continue
+        batch_index = get_batch_index(input_file)
+        pmids_by_file.setdefault(input_file, []).append(pmid)
+        upserts[pmid] = (article_hash, batch_index)
+        if pmid in indexed and indexed[pmid][1] != batch_index:
+            stale.setdefault(indexed[pmid][1], []).append(pmid)
+
+    deletes = [pmid for pmid in deleted if pmid in indexed]
+    for pmid in deletes:
+        stale.setdefault(indexed[pmid][1], []).append(pmid)
+
+    print(f"Incremental update: {len(changed)} new or changed articles in {len(pmids_by_file)} files, "
+          f"{len(latest)-len(changed)} unchanged, {len(deletes)} deleted")
+
+    return {"pmids_by_file": {f: pmids_by_file[f] for f in input_files if f in pmids_by_file},
+            "replaced_batches": sorted(get_batch_index(f) for f in replaced_files),
+            "stale": stale,
+            "upserts": upserts,
+            "deletes": deletes,
+            "files": files}
+
+
+def purge_results(folders: list, stale: dict, replaced_batches=[]):
+    '''
+    remove outdated and deleted articles from stored result files (splitter and NER output)
+    folders: result folders, files are matched to batches by the last number in their name
+    stale: batch index -> pmids to remove
+    replaced_batches: batch indices that are split again, their results are removed entirely
+    '''
+    replaced_batches = set(replaced_batches)
+    for folder in folders:
+        for path in storage.list_shards(os.path.join(folder, "")):
+            batch_index = storage.get_shard_index(path)
+            if batch_index in replaced_batches:
+                os.remove(path)
+                continue
+            if batch_index not in stale:
+                continue
+
+            articles = storage.read_shard(path)
+            n = len(articles)
+            for pmid in stale[batch_index]:
+                articles.pop(pmid, None)
+            if len(articles) < n:
+                storage.write_shard(path, articles)
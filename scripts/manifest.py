@@ -0,0 +1,86 @@
+# coding=utf-8
+## Per-shard completion manifest for long splitter and NER runs. Every finished shard appends one line to
+## manifest.jsonl in the output folder, so a restarted run can skip the shards that are already done
+
+import os
+import json
+import time
+
+MANIFEST_FILE = "manifest.jsonl"
+
+
+def get_manifest_path(output_folder: str):
+    return os.path.join(output_folder, MANIFEST_FILE)
+
+
+def mark_done(output_folder: str, shard: str, output_file: str):
+    '''
+    record a finished shard. Called from worker processes, each record is a single short append
+    shard: name of the input shard (file name, or batch name for streamed input)
+    output_file: the file written for it
+    '''
+    record = json.dumps({"shard": shard, "output": output_file, "time": time.time()}, ensure_ascii=False)
+    with open(get_manifest_path(output_folder), "a", encoding="utf-8") as f:
+        f.write(record + "\n")
+
+
+def mark_run(output_folder: str, params: dict):
+    '''
+    record the parameters a run splits its input with (e.g. input file and batch size for streamed input),
+    the shard names only identify the same batches as long as these are unchanged
+    '''
+    record = json.dumps({"run": params, "time": time.time()}, ensure_ascii=False)
+    with open(get_manifest_path(output_folder), "a", encoding="utf-8") as f:
+        f.write(record + "\n")
+
+
+def get_run(output_folder: str):
+    '''
+    returns the parameters of the last run recorded with mark_run, None if there is none
+    '''
+    path = get_manifest_path(output_folder)
+    if not os.path.isfile(path):
+        return None
+
+    params = None
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "run" in record:
+                params = record["run"]
+
+    return params
+
+
+def completed(output_folder: str):
+    '''
+    shards recorded as done whose output file still exists
+
+    returns set of shard names
+    '''
+    path = get_manifest_path(output_folder)
+    if not os.path.isfile(path):
+        return set()
+
+    done = set()
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # a line cut off by a crash
+                continue
+            if "shard" in record and os.path.isfile(record["output"]):
+                done.add(record["shard"])
+
+    return done
+
+
+def clear(output_folder: str):
+    try:
+        os.remove(get_manifest_path(output_folder))
+    except OSError:
+        pass
@@ -7,7 +7,7 @@ def read_infile(infile):
     with open(infile, encoding="utf8") as f:
         return f.readlines()
     
-def generate_classification_report(pred_file, true_file, outfile, pred_sep=" ", true_sep=" "):
+def read_labels(pred_file, true_file, pred_sep=" ", true_sep=" "):
     y_true = []
     y_pred = []
     pred_file_lines = read_infile(pred_file)
@@ -31,9 +31,24 @@ def generate_classification_report(pred_file, true_file, outfile, pred_sep=" ",
                 y_pred.append(yp)
             except:
                 pass
+
+    return y_true, y_pred
+
+def generate_classification_report(pred_file, true_file, outfile, pred_sep=" ", true_sep=" "):
+    y_true, y_pred = read_labels(pred_file, true_file, pred_sep, true_sep)
+
     with open(outfile, "w", encoding="utf8") as f:
         f.write(classification_report([y_true],[y_pred], digits=5))
 
+    return f1_score([y_true],[y_pred])
+
+def get_recall(pred_file, true_file, pred_sep=" ", true_sep=" "):
+    '''
+    entity level recall of a prediction file against the annotated file
+    '''
+    y_true, y_pred = read_labels(pred_file, true_file, pred_sep, true_sep)
+    return recall_score([y_true],[y_pred])
+
 def get_metrics(metrics_config):
     pred_sep = metrics_config["pred_sep"] if "pred_sep" in metrics_config else " "
     true_sep = metrics_config["true_sep"] if "true_sep" in metrics_config else " "
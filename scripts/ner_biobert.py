@@ -2,20 +2,57 @@
 
 from transformers import AutoTokenizer, AutoModelForTokenClassification, pipeline
 from pathlib import Path, PurePosixPath
+from .token_classification import predict_in_length_buckets, encode_batch, aggregate_batch
 import os
+import numpy as np
+import torch
 
 class NER_biobert:
 
-    def __init__(self, model_dir: str, model_name: str, model_max_length=192, device=-1):
+    def __init__(self, model_dir: str, model_name: str, model_max_length=192, device=-1, quantize=False):
         self.model_path = PurePosixPath(Path(model_dir, model_name))
+        self.model_max_length = model_max_length
         self.tokenizer = AutoTokenizer.from_pretrained(self.model_path, model_max_length=model_max_length)
         self.model = AutoModelForTokenClassification.from_pretrained(self.model_path)
+
+        if quantize:
+            # INT8 dynamic quantization of the linear layers, quantized models only run on CPU
+            if device != -1 and str(device) != "cpu":
+                print("INT8 quantized model runs on CPU, ignoring device {}".format(device))
+            device = -1
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
         self.nlp = pipeline(task='ner',model=self.model,tokenizer=self.tokenizer, aggregation_strategy="max", device=device)
+        self.id2label = {int(k): v for k, v in self.model.config.id2label.items()}
         
 
     def predict(self, sequence: str):
         return self.nlp(sequence)
-        
+
+    def predict_batch(self, sequences: list, batch_size=32, desc=None):
+        '''
+        predict a list of sentences in length-sorted batches to minimise padding
+        returns a list of predictions in the same order as the input sentences
+        '''
+        return predict_in_length_buckets(sequences, lambda batch: self.nlp(batch, batch_size=batch_size),
+                                         batch_size=batch_size, desc=desc)
+
+    def encode(self, sequences: list):
+        '''
+        tokenize a batch of sentences for predict_encoded
+        '''
+        return encode_batch(self.tokenizer, sequences, self.model_max_length)
+
+    def predict_encoded(self, sequences: list, encodings):
+        '''
+        run the model on an already tokenized batch (e.g. from the pre-tokenized store) and aggregate
+        to entity groups the same way as the pipeline with aggregation_strategy="max"
+        '''
+        inputs = {name: torch.as_tensor(np.asarray(encodings[name]), dtype=torch.long, device=self.nlp.device)
+                  for name in ["input_ids", "attention_mask", "token_type_ids"]}
+        with torch.no_grad():
+            logits = self.model(**inputs).logits.float().cpu().numpy()
+
+        return aggregate_batch(sequences, encodings, logits, self.tokenizer, self.id2label)
         
 
 if __name__ == "__main__":
@@ -0,0 +1,162 @@
+# coding=utf-8
+## Dictionary NER with a precompiled Aho-Corasick automaton. Matching is linear in the length of the
+## text and independent of the dictionary size, and needs no spacy pipeline
+
+import os
+import re
+import pickle
+from collections import deque
+from . import util
+
+_TOKEN = re.compile(r'\w+|[^\w\s]')
+
+
+def normalize(text):
+    '''
+    lowercase text while keeping character offsets unchanged
+    '''
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    # a few characters (e.g. "İ") lowercase to more than one character, keep those as they are
+    return "".join(c.lower() if len(c.lower()) == 1 else c for c in text)
+
+
+class DictionaryAutomaton:
+
+    def __init__(self, terms):
+        '''
+        build an Aho-Corasick automaton over lowercased dictionary terms
+        terms: list of dictionary terms
+        '''
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+        for term in terms:
+            term = normalize(term.strip())
+            if len(term) == 0:
+                continue
+            state = 0
+            for c in term:
+                if c not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][c] = len(self.goto)-1
+                state = self.goto[state][c]
+            if len(term) not in self.output[state]:
+                self.output[state].append(len(term))
+
+        # breadth first pass to set failure links and merge outputs of suffix states
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, next_state in self.goto[state].items():
+                queue.append(next_state)
+                f = self.fail[state]
+                while f and c not in self.goto[f]:
+                    f = self.fail[f]
+                fail_state = self.goto[f].get(c, 0)
+                self.fail[next_state] = fail_state if fail_state != next_state else 0
+                self.output[next_state] = self.output[next_state] + [l for l in self.output[self.fail[next_state]] if l not in self.output[next_state]]
+
+    @classmethod
+    def from_dictionary(cls, vocab_path, cache_folder="models/cache/", min_length=1):
+        '''
+        build the automaton from a dictionary file (one term per line), or load it from
+        cache_folder where it is stored keyed by a hash of the dictionary file
+        min_length: leave out terms shorter than this
+        '''
+        cache_file = None
+        if cache_folder:
+            key = util.get_file_hash(vocab_path, cls.__name__, min_length)
+            cache_file = os.path.join(cache_folder, f"automaton-{os.path.splitext(os.path.basename(vocab_path))[0]}-{key}.pkl")
+
+        if cache_file and os.path.isfile(cache_file):
+            with open(cache_file, "rb") as f:
+                automaton = pickle.load(f)
+            print(f"Loaded compiled dictionary from {cache_file}")
+            return automaton
+
+        with open(vocab_path, "r", encoding="utf-8") as f:
+            automaton = cls([line for line in f if len(line.strip()) >= min_length])
+
+        if cache_file:
+            os.makedirs(cache_folder, exist_ok=True)
+            tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, "wb") as f:
+                pickle.dump(automaton, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, cache_file)
+
+        return automaton
+
+    def find(self, text):
+        '''
+        find all dictionary terms in the text that start and end on token boundaries
+        text: text to search
+
+        returns sorted list of (start, end) character offsets, end exclusive
+        '''
+        lowered = normalize(text)
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        matches = []
+        state = 0
+
+        for i, c in enumerate(lowered):
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+
+            for length in output[state]:
+                start = i-length+1
+                end = i+1
+                # a match must not start or end in the middle of a word
+                if start > 0 and lowered[start].isalnum() and lowered[start-1].isalnum():
+                    continue
+                if end < len(lowered) and lowered[end-1].isalnum() and lowered[end].isalnum():
+                    continue
+                matches.append((start, end))
+
+        return sorted(matches)
+
+    def contains(self, text):
+        '''
+        True if any dictionary term occurs in the text, also inside words (no boundary check).
+        Used as a high recall screen before more expensive models
+        '''
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        state = 0
+
+        for c in normalize(text):
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            if output[state]:
+                return True
+
+        return False
+
+    def predict(self, text):
+        '''
+        returns entities and entity spans in the same format as the spacy PhraseMatcher NER
+        (span is first and last character offset, both inclusive)
+        '''
+        entities = []
+        spans = []
+        for start, end in self.find(text):
+            entities.append(text[start:end])
+            spans.append((start, end-1))
+
+        return entities, spans
+
+
+def tokenize(text):
+    '''
+    simple word/punctuation tokenizer used for store_tokens, since the automaton needs no tokenizer
+    '''
+    return _TOKEN.findall(text)
@@ -0,0 +1,244 @@
+# coding=utf-8
+## Evaluation harness for NER model variants on an IOB test file ("word label" per line, blank line between sentences).
+## Run from the repository root, for example:
+## python -m scripts.ner_eval -m aitslab -n biobert_huner_chemical_v1 -t data/test.txt -o results/eval/chemical/
+## python -m scripts.ner_eval --mode prefilter --vocab_path data/chemical_vocab.txt -t data/test.txt -o results/eval/prefilter/
+
+import argparse
+import io
+import os
+import time
+from . import metrics
+
+
+def read_iob_file(infile, sep=" "):
+    '''
+    read an IOB file into sentences
+    returns list of sentences, each a list of (word, label) pairs
+    '''
+    sentences = []
+    sentence = []
+    for line in metrics.read_infile(infile):
+        line = line.strip()
+        if len(line) == 0:
+            if len(sentence) > 0:
+                sentences.append(sentence)
+            sentence = []
+            continue
+        parts = line.split(sep)
+        sentence.append((parts[0], parts[-1]))
+
+    if len(sentence) > 0:
+        sentences.append(sentence)
+
+    return sentences
+
+
+def get_label_type(sentences):
+    '''
+    entity type used in the gold labels (e.g. "Chemical" for "B-Chemical"), empty if labels are plain B/I/O
+    '''
+    for sentence in sentences:
+        for word, label in sentence:
+            if "-" in label:
+                return label.split("-", 1)[1]
+    return ""
+
+
+def sentence_text(sentence):
+    '''
+    join the words of a sentence with spaces
+    returns text and the (start, end) character offsets of each word
+    '''
+    offsets = []
+    pos = 0
+    for word, label in sentence:
+        offsets.append((pos, pos+len(word)))
+        pos += len(word)+1
+
+    return " ".join(word for word, label in sentence), offsets
+
+
+def spans_to_iob(offsets, spans, label_type=""):
+    '''
+    convert predicted entity character spans (end exclusive) to word level IOB labels
+    '''
+    suffix = f"-{label_type}" if label_type else ""
+    labels = ["O"]*len(offsets)
+    for start, end in spans:
+        first = True
+        for i, (w_start, w_end) in enumerate(offsets):
+            if w_start < end and w_end > start:
+                labels[i] = ("B" if first else "I") + suffix
+                first = False
+
+    return labels
+
+
+def predict_iob(predict_batch, sentences, batch_size=32, label_type=""):
+    '''
+    predict IOB labels for the sentences of an IOB file
+    predict_batch: function taking (texts, batch_size) and returning a list of HF style predictions
+    (dicts with start and end) for each text
+
+    returns list of label lists and the time spent in prediction
+    '''
+    texts_offsets = [sentence_text(sentence) for sentence in sentences]
+
+    start = time.perf_counter()
+    predictions = predict_batch([text for text, offsets in texts_offsets], batch_size)
+    seconds = time.perf_counter() - start
+
+    labels = [spans_to_iob(offsets, [(pred["start"], pred["end"]) for pred in prediction], label_type)
+              for (text, offsets), prediction in zip(texts_offsets, predictions)]
+
+    return labels, seconds
+
+
+def write_iob(outfile, sentences, labels, sep=" "):
+    '''
+    write predicted labels in the same layout as the gold IOB file
+    '''
+    with open(outfile, "w", encoding="utf8") as f:
+        for sentence, sentence_labels in zip(sentences, labels):
+            for (word, gold), label in zip(sentence, sentence_labels):
+                f.write(f"{word}{sep}{label}\n")
+            f.write("\n")
+
+
+def get_model_size_mb(model):
+    '''
+    size of the serialized model weights in MB
+    '''
+    import torch
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes/1e6
+
+
+def evaluate_quantization(model_dir, model_name, true_file, output_folder, batch_size=32, sep=" "):
+    '''
+    compare the fp32 and INT8 dynamically quantized versions of a BioBERT model on the same IOB test file.
+    Writes predictions and classification reports for both models, and a summary with F1, throughput and model size
+
+    returns list of result rows (dicts)
+    '''
+    from .ner_biobert import NER_biobert
+
+    os.makedirs(output_folder, exist_ok=True)
+    sentences = read_iob_file(true_file, sep=sep)
+    label_type = get_label_type(sentences)
+
+    results = []
+    for mode, quantize in [("fp32", False), ("int8", True)]:
+        print(f"Evaluating {model_name} ({mode})")
+        session = NER_biobert(model_dir=model_dir, model_name=model_name, quantize=quantize)
+        labels, seconds = predict_iob(lambda texts, bs: session.predict_batch(texts, batch_size=bs),
+                                      sentences, batch_size=batch_size, label_type=label_type)
+
+        pred_file = os.path.join(output_folder, f"predictions_{mode}.txt")
+        write_iob(pred_file, sentences, labels, sep=sep)
+        f1 = metrics.generate_classification_report(pred_file, true_file,
+                                                    os.path.join(output_folder, f"classification_report_{mode}.txt"),
+                                                    pred_sep=sep, true_sep=sep)
+        results.append({"mode": mode,
+                        "f1": f1,
+                        "seconds": seconds,
+                        "sentences_per_sec": len(sentences)/seconds if seconds > 0 else float("inf"),
+                        "model_mb": get_model_size_mb(session.model)})
+
+    results[1]["f1_change"] = results[1]["f1"] - results[0]["f1"]
+    results[1]["speedup"] = results[0]["seconds"]/results[1]["seconds"] if results[1]["seconds"] > 0 else float("inf")
+    results[0]["f1_change"] = 0.0
+    results[0]["speedup"] = 1.0
+
+    write_summary(results, os.path.join(output_folder, "quantization_summary.tsv"))
+    return results
+
+
+def evaluate_prefilter(prefilter_config, true_file, output_folder, sep=" ", cache_folder="models/cache/"):
+    '''
+    recall of the NER pre-filter on an IOB test file: gold labels are kept for the sentences the filter passes and
+    set to O for the ones it skips, which is the best any model behind the filter can do.
+    Writes the filtered labels, a classification report and a summary with pass rate and recall
+
+    returns list with one result row (dict)
+    '''
+    from .prefilter import SentenceFilter
+
+    os.makedirs(output_folder, exist_ok=True)
+    sentences = read_iob_file(true_file, sep=sep)
+    sentence_filter = SentenceFilter.from_config(prefilter_config, cache_folder=cache_folder)
+
+    passed = sentence_filter.filter([sentence_text(sentence)[0] for sentence in sentences])
+    labels = [[label if is_candidate else "O" for word, label in sentence]
+              for sentence, is_candidate in zip(sentences, passed)]
+
+    pred_file = os.path.join(output_folder, "predictions_prefilter.txt")
+    write_iob(pred_file, sentences, labels, sep=sep)
+    metrics.generate_classification_report(pred_file, true_file,
+                                           os.path.join(output_folder, "classification_report_prefilter.txt"),
+                                           pred_sep=sep, true_sep=sep)
+
+    with_entities = [any(label != "O" for word, label in sentence) for sentence in sentences]
+    n_with_entities = sum(with_entities)
+    results = [{"sentences": len(sentences),
+                "pass_rate": sum(passed)/len(sentences) if len(sentences) > 0 else 0.0,
+                "sentence_recall": (sum(p and e for p, e in zip(passed, with_entities))/n_with_entities
+                                    if n_with_entities > 0 else 1.0),
+                "entity_recall": metrics.get_recall(pred_file, true_file, pred_sep=sep, true_sep=sep)}]
+
+    write_summary(results, os.path.join(output_folder, "prefilter_summary.tsv"))
+    return results
+
+
+def write_summary(results, outfile):
+    '''
+    print results as a table and write them to a TSV file
+    '''
+    cols = list(results[0])
+    lines = ["\t".join(cols)]
+    for row in results:
+        lines.append("\t".join(f"{row[c]:.5f}" if isinstance(row[c], float) else str(row[c]) for c in cols))
+
+    print("\n".join(lines))
+    with open(outfile, "w", encoding="utf8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+if __name__ == "__main__":
+
+    description = ("Compare F1 and throughput of a BioBERT model with and without INT8 dynamic quantization, "
+                   "or measure the recall of the NER pre-filter")
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--mode", type=str, required=False, default="quantization", choices=["quantization", "prefilter"],
+                        help="what to evaluate")
+    parser.add_argument('-m', "--model_folder", type=str, required=False,
+                        help="model folder or huggingface repo, e.g. aitslab (quantization)")
+    parser.add_argument('-n', "--model_name", type=str, required=False,
+                        help="model name, e.g. biobert_huner_chemical_v1 (quantization)")
+    parser.add_argument('-t', "--true_file", type=str, required=True,
+                        help="IOB test file with one word and label per line")
+    parser.add_argument('-o', "--output_folder", type=str, required=True,
+                        help="folder for predictions, reports and summary")
+    parser.add_argument('-b', "--batch_size", type=int, required=False, default=32,
+                        help="number of sentences per forward pass")
+    parser.add_argument('-s', "--sep", type=str, required=False, default=" ",
+                        help="separator between word and label")
+    parser.add_argument("--vocab_path", type=str, required=False, default="",
+                        help="lexicon of the entity type, one term per line (prefilter)")
+    parser.add_argument("--patterns", type=str, nargs="*", required=False, default=[],
+                        help="regular expressions that also pass a sentence (prefilter)")
+    parser.add_argument("--min_term_length", type=int, required=False, default=3,
+                        help="lexicon terms shorter than this are ignored (prefilter)")
+
+    args = parser.parse_args()
+
+    if args.mode == "prefilter":
+        evaluate_prefilter({"vocab_path": args.vocab_path, "patterns": args.patterns, "min_term_length": args.min_term_length},
+                           args.true_file, args.output_folder, sep=args.sep)
+    else:
+        if not args.model_folder or not args.model_name:
+            parser.error("--model_folder and --model_name are required for the quantization mode")
+        evaluate_quantization(args.model_folder, args.model_name, args.true_file, args.output_folder,
+                              batch_size=args.batch_size, sep=args.sep)
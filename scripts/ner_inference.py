@@ -1,99 +1,159 @@
 # coding=utf-8
 
 import os
+import hashlib
 import numpy as np
 import onnxruntime
-from transformers import BertTokenizer
-from typing import List
+from pathlib import Path, PurePosixPath
+from transformers import AutoConfig, AutoTokenizer
+from .token_classification import predict_in_length_buckets, encode_batch, aggregate_batch
+
+_INPUT_NAMES = ["input_ids", "attention_mask", "token_type_ids"]
+
+
+def export_onnx(model_path: str, onnx_path: str, opset_version=13):
+    '''
+    export a fine-tuned huggingface token classification checkpoint to ONNX with dynamic batch and sequence axes
+    model_path: local folder or huggingface hub name of the model
+    onnx_path: output .onnx file
+    '''
+    import torch
+    from transformers import AutoModelForTokenClassification
+
+    print("Exporting model to ONNX:\n  {}".format(onnx_path))
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model = AutoModelForTokenClassification.from_pretrained(model_path)
+    model.config.return_dict = False
+    model.eval()
+
+    dummy = tokenizer(["nitrous oxide in HeLa cells"], return_tensors="pt", return_token_type_ids=True)
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in _INPUT_NAMES + ["logits"]}
+
+    os.makedirs(os.path.dirname(onnx_path) or ".", exist_ok=True)
+    tmp_path = f"{onnx_path}.{os.getpid()}.tmp"
+    with torch.no_grad():
+        torch.onnx.export(model,
+                          tuple(dummy[name] for name in _INPUT_NAMES),
+                          tmp_path,
+                          input_names=_INPUT_NAMES,
+                          output_names=["logits"],
+                          dynamic_axes=dynamic_axes,
+                          opset_version=opset_version,
+                          do_constant_folding=True)
+    os.replace(tmp_path, onnx_path)
+
+
+def get_checkpoint_fingerprint(model_path: str):
+    '''
+    fingerprint of a checkpoint the ONNX model is exported from: the size and modification time of the files of a
+    local model folder (as prediction_cache.get_model_identity), the name of a hub model
+    '''
+    h = hashlib.sha256(model_path.encode("utf-8"))
+    if os.path.isdir(model_path):
+        for name in sorted(os.listdir(model_path)):
+            stat = os.stat(os.path.join(model_path, name))
+            h.update(f"{name}:{stat.st_size}:{int(stat.st_mtime)}\n".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def get_fingerprint_file(onnx_path: str):
+    return onnx_path + ".fingerprint"
+
+
+def is_export_current(onnx_path: str, fingerprint: str, cached: bool):
+    '''
+    whether an exported ONNX file matches the checkpoint. The fingerprint of the checkpoint is stored next to every
+    export; a file in the cache without one (or with another) is exported again, a file given as onnx_path
+    without one is used as is
+    '''
+    if not os.path.isfile(onnx_path):
+        return False
+    fingerprint_file = get_fingerprint_file(onnx_path)
+    if not os.path.isfile(fingerprint_file):
+        return not cached
+    with open(fingerprint_file, "r", encoding="utf-8") as f:
+        return f.read().strip() == fingerprint
 
 
 class NERInferenceSession_biobert_onnx:
 
-    def __init__(self, model_dir: str, model_name: str, model_vocab: str, labels: List[str]):
-        self.model_path = os.path.join(model_dir, model_name)
-        self.vocab_path = model_vocab
-        self.labels = labels
-        self.tokenizer = BertTokenizer.from_pretrained(self.vocab_path)
-        self.session = self.create_session()
+    def __init__(self, model_dir: str, model_name: str, onnx_path=None, model_max_length=192,
+                 intra_op_threads=0, inter_op_threads=0, cache_folder="models/cache/"):
+        '''
+        BioBERT NER with ONNX Runtime. The huggingface checkpoint under model_dir/model_name is exported
+        to ONNX on first use (to onnx_path, or to cache_folder if not given), and again when the checkpoint changes
+        intra_op_threads, inter_op_threads: ONNX Runtime thread pools, 0 lets ONNX Runtime decide
+        '''
+        self.model_path = str(PurePosixPath(Path(model_dir, model_name)))
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_path, model_max_length=model_max_length)
+        self.id2label = {int(k): v for k, v in AutoConfig.from_pretrained(self.model_path).id2label.items()}
+        self.model_max_length = model_max_length
+
+        cached = not onnx_path
+        if cached:
+            onnx_path = os.path.join(cache_folder, "onnx", self.model_path.strip("/").replace("/", "_") + ".onnx")
+        self.onnx_path = onnx_path
+        # a checkpoint retrained or replaced in place must not be run with the export of the old one
+        fingerprint = get_checkpoint_fingerprint(self.model_path)
+        if not is_export_current(self.onnx_path, fingerprint, cached):
+            export_onnx(self.model_path, self.onnx_path)
+            with open(get_fingerprint_file(self.onnx_path), "w", encoding="utf-8") as f:
+                f.write(fingerprint)
+
         onnxruntime.set_default_logger_severity(3)
+        self.session = self.create_session(intra_op_threads, inter_op_threads)
+        self.input_names = [i.name for i in self.session.get_inputs()]
 
-    def create_session(self) -> onnxruntime.InferenceSession:
+    def create_session(self, intra_op_threads=0, inter_op_threads=0) -> onnxruntime.InferenceSession:
         # Allow caller to use symlink to model
-        if os.path.islink(self.model_path):
-            self.model_path = os.readlink(self.model_path)
-        print("Loading model:\n  {}".format(self.model_path))
-        session = onnxruntime.InferenceSession(self.model_path)
-        print("Model loaded succesfully\n")
-        return session
+        if os.path.islink(self.onnx_path):
+            self.onnx_path = os.readlink(self.onnx_path)
+        print("Loading model:\n  {}".format(self.onnx_path))
 
-    def encode_sequence(self, sequence: str):
-        encoded = self.tokenizer.encode_plus(
-            sequence,
-            max_length=128, #TO DO: check if this number should be changed
-            add_special_tokens=True,
-            return_token_type_ids=True,
-            pad_to_max_length=True,
-            return_attention_mask=True,
-            return_tensors="pt",
-        )
-
-        tokens = self.tokenizer.convert_ids_to_tokens(encoded["input_ids"][0])
-        for i, token in enumerate(tokens):
-            if token == self.tokenizer.convert_ids_to_tokens(0):
-                tokens = tokens[:i]
-                break
-
-        token_type_ids = np.array(encoded["token_type_ids"].numpy(), dtype=np.int32)
-        attention_mask = np.array(encoded["attention_mask"].numpy(), dtype=np.int32)
-        input_ids = np.array(encoded["input_ids"].numpy(), dtype=np.int32)
-        label_ids = np.array([0], dtype=np.int32)
-
-        return {
-            "tokens": tokens,
-            "token_type_ids": token_type_ids,
-            "attention_mask": attention_mask,
-            "input_ids": input_ids,
-            "label_ids": label_ids
-        }
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
 
-    def predict(self, sequence: str):
-        encodings = self.encode_sequence(sequence)
-
-        _, logits, _ = self.session.run([], {
-            "segment_ids_1:0": encodings["token_type_ids"],
-            "input_mask_1_raw_output___9:0": encodings["attention_mask"],
-            "input_ids_1:0": encodings["input_ids"],
-            "label_ids_1:0": encodings["label_ids"]}
-        )
-
-        predicted_labels = []
+        session = onnxruntime.InferenceSession(self.onnx_path, options, providers=["CPUExecutionProvider"])
+        print("Model loaded succesfully\n")
+        return session
 
-        for index in logits[0]:
-            predicted_labels.append(self.labels[index])
+    def encode(self, sequences: list):
+        '''
+        tokenize a batch of sentences, padded to the longest sentence in the batch
+        '''
+        return encode_batch(self.tokenizer, sequences, self.model_max_length)
 
-        token_label_pairs = []
+    def predict_encoded(self, sequences: list, encodings):
+        '''
+        run the model on an encoded batch and aggregate to entity groups like aggregation_strategy="max"
+        '''
+        inputs = {name: np.asarray(encodings[name], dtype=np.int64) for name in self.input_names}
+        logits = self.session.run(["logits"], inputs)[0]
 
-        for token, label in zip(encodings["tokens"], predicted_labels):
-            token_label_pairs.append((token, label))
+        return aggregate_batch(sequences, encodings, logits, self.tokenizer, self.id2label)
 
+    def predict(self, sequence: str):
+        return self.predict_encoded([sequence], self.encode([sequence]))[0]
 
-        return token_label_pairs
+    def predict_batch(self, sequences: list, batch_size=32, desc=None):
+        '''
+        predict a list of sentences in length-sorted batches to minimise padding
+        returns a list of predictions in the same order as the input sentences
+        '''
+        return predict_in_length_buckets(sequences, lambda batch: self.predict_encoded(batch, self.encode(batch)),
+                                         batch_size=batch_size, desc=desc)
 
 
 if __name__ == "__main__":
-    
-    model_dir = "C:/Users/rafsa/Documents/AITSLAB/nlp_pipeline/rafsan/models/biobert/"
-    model_name = "biobert_ner.onnx"
-    model_vocab = model_dir  + "vocab.txt"
-    labels = ["[PAD]", "B", "I", "O", "X", "[CLS]", "[SEP]"]
-    seq = "he is feeing very sick nitrous oxide NO nucleus eucaryotic A549 HeLa Cells oxygen"
-    
-    ner_session = NERInferenceSession_biobert_onnx(model_dir=model_dir,
-                                                    model_name=model_name, 
-                                                    model_vocab=model_vocab,
-                                                    labels=labels)
-    
-    
 
+    model_dir = "aitslab"
+    model_name = "biobert_huner_chemical_v1"
+    seq = "he is feeing very sick nitrous oxide NO nucleus eucaryotic A549 HeLa Cells oxygen"
 
+    ner_session = NERInferenceSession_biobert_onnx(model_dir=model_dir,
+                                                    model_name=model_name)
 
+    print(ner_session.predict(seq))
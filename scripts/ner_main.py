@@ -2,118 +2,194 @@
 
 import spacy
 import os
-import re
 import json
+import copy
+import queue
+import threading
 import pandas as pd
 from tqdm import tqdm
 from spacy.matcher import PhraseMatcher
 from datasets import Dataset, load_dataset
-from . import ner_biobert, util
+from . import article_index, cpu_budget, manifest, ner_biobert, ner_dictionary, ner_spacy, prediction_cache, prefilter, pretokenizer, storage
 from .ner_inference import NERInferenceSession_biobert_onnx
+from .token_classification import predict_in_length_buckets, encode_in_length_buckets, predict_encoded_batches, encode_batch
 
-def run_ner_main(ner_config: dict, batch_file, device=-1):
+# models loaded in this process, keyed by model configuration, so that each worker process
+# loads its model once and reuses it for every batch file it handles
+_models = {}
+
+def load_model(ner_config: dict, device=-1):
     '''
-    run NER in batches from sentence splitter output
+    load the model for the configured model_type, or return it from the per-process cache
+    spacy_phrasematcher: returns (nlp, matcher)
+    dictionary_automaton: returns DictionaryAutomaton
+    biobert_finetuned: returns NER_biobert session
+    biobert_onnx: returns NERInferenceSession_biobert_onnx session
     '''
-
-    with open(batch_file, "r",encoding="utf-8") as f:
-        articles = json.loads(f.read())
+    key = (ner_config["model_type"], ner_config.get("model_folder", ""), ner_config["model_name"],
+           ner_config.get("vocab_path", ""), ner_config.get("entity_type", ""), ner_config.get("quantize", False), str(device))
     
-    # get batch IDs
-    regex=re.compile(r'\d+')
-    try:
-        batch_index=int(regex.findall(os.path.basename(batch_file))[-1])
-    except:
-        print(batch_file)
-        raise Exception("Filenames not numbered!")
-        
-    if len(articles)==0:
-        util.append_to_json_file(f'{ner_config["output_path"]}/{ner_config["output_file_prefix"]}-{batch_index}.json', articles)        
-        return batch_index
-        
-    # Prepare spacy, if it is needed
+    if key in _models:
+        return _models[key]
+
     if ner_config["model_type"] == 'spacy_phrasematcher':
         if not ner_config["multiprocessing"]:
             spacy.prefer_gpu()
             
         print("Running NER with spacy")
-        nlp = spacy.load(ner_config["model_name"])
-        terms = []
-        with open(ner_config["vocab_path"],'r') as f:
-            for line in f:
-                x = line.strip()
-                terms.append(x)
-        print("Phraselist complete")
-
-        matcher = PhraseMatcher(nlp.vocab, attr="LOWER")
-        patterns = [nlp.make_doc(term) for term in terms]
-        matcher.add(ner_config["entity_type"], patterns)
-        
-        # Run prediction on each sentence in each article.
-        for pmid in tqdm(articles, desc=f'batch:{batch_index}'):
-
-            sentences = articles[pmid]["sentences"]
+        nlp = ner_spacy.load_tokenizer(ner_config["model_name"])
+        matcher = ner_spacy.load_phrasematcher(nlp, ner_config["model_name"], ner_config["vocab_path"], ner_config["entity_type"],
+                                               cache_folder=ner_config.get("cache_folder", "models/cache/"))
+        _models[key] = (nlp, matcher)
 
-            #Predict with spacy PhraseMatcher, if it has been selected       
+    elif ner_config["model_type"] == 'dictionary_automaton':
+        print("Running NER with dictionary automaton")
+        _models[key] = ner_dictionary.DictionaryAutomaton.from_dictionary(ner_config["vocab_path"],
+                                                                         cache_folder=ner_config.get("cache_folder", "models/cache/"))
 
-            for i, sentence in enumerate(sentences):
-                ner_class = ner_config["entity_type"]
-                
-                doc = nlp(sentence["text"])
-                if ner_config["store_tokens"] == "yes":
-                    tokens = []
-                    # tokens_idxs = []  #uncomment if you want a list of token character offsets within the sentence
-                    for token in doc:
-                        tokens.append(token.text) #to get a list of tokens in the sentence
-                    # tokens_idxs.append(token.idx) #uncomment if you want a list of token character offsets within the sentence
-                    articles[pmid]["sentences"][i]["tokens"] = tokens
-
-                entities = []
-                spans = []
-                matches = matcher(doc)
-
-                for match_id, start, end in matches:
-                    span = doc[start:end]
-                    ent = span.text
-                    entities.append(ent)
-                    first_char = span.start_char
-                    last_char = span.end_char - 1
-                    spans.append((first_char, last_char)) 
-
-
-                #articles[pmid]["sentences"][i]["NER class"] = ner_class
-                articles[pmid]["sentences"][i]["entities"] = entities
-                articles[pmid]["sentences"][i]["entity_spans"] = spans
-
-
-                   
     elif ner_config["model_type"] == 'biobert_finetuned':
-        
-        #print("Running NER with finetuned BioBERT")
-        
-        ner_session = ner_biobert.NER_biobert(
-        model_dir=ner_config["model_folder"],
+        _models[key] = ner_biobert.NER_biobert(
+            model_dir=ner_config["model_folder"],
             model_name=ner_config["model_name"],
-            device=device
+            device=device,
+            quantize=ner_config.get("quantize", False)
         )
 
-        def wrapper_predict(example):
-            '''
-            a wrapper to run map function with predict
-            '''
-            try:
-                example["prediction"] = ner_session.predict(example["text"])
-            except:
-                example["prediction"]  = []
+    elif ner_config["model_type"] == 'biobert_onnx':
+        _models[key] = NERInferenceSession_biobert_onnx(
+            model_dir=ner_config["model_folder"],
+            model_name=ner_config["model_name"],
+            onnx_path=ner_config.get("onnx_path", ""),
+            intra_op_threads=ner_config.get("intra_op_threads", 0),
+            inter_op_threads=ner_config.get("inter_op_threads", 0),
+            cache_folder=ner_config.get("cache_folder", "models/cache/")
+        )
 
-            return example
+    else:
+        raise Exception(f'ERROR! Unknown model_type: {ner_config["model_type"]}')
+
+    return _models[key]
+
+def get_model_configs(ner_config: dict):
+    '''
+    list of model configurations to run. Each entry of ner_config["models"] overrides the model keys
+    (model_type, model_folder, model_name, vocab_path, entity_type, ...) of the NER config.
+    The pre-filter is not inherited: its lexicon belongs to one entity type, so each entry sets its own "prefilter"
+    '''
+    models = ner_config.get("models", [])
+    if len(models) == 0:
+        return [ner_config]
+
+    shared = {key: value for key, value in ner_config.items() if key != "prefilter"}
+    return [{**shared, **model} for model in models]
+
+def init_worker(ner_config: dict, device=-1, thread_plan=None, slot_counter=None, io_config=None):
+    '''
+    initializer for NER worker processes: pin the thread counts of the worker (see cpu_budget), set the json codec
+    (see storage.configure) and load the model(s) once before the first batch file arrives
+    '''
+    if io_config is not None:
+        storage.configure(io_config)
+    if thread_plan is not None:
+        cpu_budget.init_worker_threads(thread_plan, slot_counter)
+
+    for model_config in get_model_configs(ner_config):
+        load_model(model_config, device)
+
+def load_pretokenized_shard(ner_config: dict, ner_session, texts: list, batch_file=None):
+    '''
+    pre-tokenized store of a splitter output file for a BioBERT model, None if not configured or not available
+    '''
+    if not ner_config.get("pretokenized_path", "") or batch_file is None:
+        return None
+    return pretokenizer.load_shard(ner_config["pretokenized_path"], ner_session.tokenizer,
+                                   ner_session.model_max_length, batch_file, texts)
+
+def encode_sentences(ner_config: dict, sentences: list, batch_file=None, device=-1, tokenizer=None):
+    '''
+    tokenize sentences for a BioBERT model ahead of inference, in length-sorted batches
+    (from the pre-tokenized store if it has the batch file)
+    tokenizer: tokenizer to use instead of the model's own, e.g. a copy owned by another thread
+
+    returns encoded batches for annotate_sentences
+    '''
+    ner_session = load_model(ner_config, device)
+    tokenizer = ner_session.tokenizer if tokenizer is None else tokenizer
+    texts = [sentence["text"] for sentence in sentences]
+    batch_size = ner_config.get("batch_size", 32)
+
+    shard = load_pretokenized_shard(ner_config, ner_session, texts, batch_file)
+    if shard is not None:
+        return encode_in_length_buckets(texts, shard.get_batch, batch_size=batch_size, lengths=shard.lengths())
+
+    return encode_in_length_buckets(texts, lambda idxs: encode_batch(tokenizer, [texts[i] for i in idxs], ner_session.model_max_length),
+                                    batch_size=batch_size)
+
+def annotate_sentences(ner_config: dict, sentences: list, batch_index, device=-1, shared=None, batch_file=None, encoded_batches=None):
+    '''
+    run one model over a list of sentence dicts, adding entities and entity_spans (and tokens) in place
+    shared: optional dict for work shared between models over the same sentences (e.g. spacy tokenization)
+    batch_file: splitter output file of the sentences, used to find its pre-tokenized store
+    encoded_batches: BioBERT models only, sentences already tokenized by encode_sentences
+    '''
+    shared = {} if shared is None else shared
+
+    # Prepare spacy, if it is needed
+    if ner_config["model_type"] == 'spacy_phrasematcher':
+        nlp, matcher = load_model(ner_config, device)
+
+        # tokenize once per spacy model and reuse the docs for every dictionary on the same model
+        docs_key = ("spacy_docs", ner_config["model_name"])
+        if docs_key not in shared:
+            shared[docs_key] = list(nlp.tokenizer.pipe((sentence["text"] for sentence in sentences), batch_size=256))
         
-        articles_dataset = biobert_process_articles(articles)
+        # Run prediction on all sentences of the batch file at once (tokenizer only, in bulk).
+        ner_spacy.run_phrasematcher(nlp, matcher, sentences, store_tokens=ner_config["store_tokens"],
+                                    desc=f'batch:{batch_index}', docs=shared[docs_key])
+
+    elif ner_config["model_type"] == 'dictionary_automaton':
+
+        automaton = load_model(ner_config, device)
+
+        for sentence in tqdm(sentences, desc=f'batch:{batch_index}'):
+            if ner_config["store_tokens"] == "yes":
+                sentence["tokens"] = ner_dictionary.tokenize(sentence["text"])
 
-        articles_dataset_processed = articles_dataset.map(wrapper_predict,desc="Batch "+str(batch_index))
+            entities, spans = automaton.predict(sentence["text"])
+            sentence["entities"] = entities
+            sentence["entity_spans"] = spans
 
-        articles_processed = convert_dataset_to_dict(articles, articles_dataset_processed)
-        articles = articles_processed
+    elif ner_config["model_type"] in ['biobert_finetuned', 'biobert_onnx']:
+        
+        #print("Running NER with finetuned BioBERT")
+        
+        ner_session = load_model(ner_config, device)
+        texts = [sentence["text"] for sentence in sentences]
+
+        shard = None
+        if encoded_batches is None:
+            shard = load_pretokenized_shard(ner_config, ner_session, texts, batch_file)
+
+        # predict all sentences of the batch file together in length-sorted batches
+        # and scatter the predictions back to their sentences
+        if encoded_batches is not None:
+            # tokenized ahead (pipelined runner), only the forward pass and aggregation run here
+            predictions = predict_encoded_batches(texts, encoded_batches, ner_session, desc="Batch "+str(batch_index))
+        elif shard is not None:
+            # token ids come from the pre-tokenized store, only the forward pass and aggregation run here
+            predictions = predict_in_length_buckets(list(range(len(texts))),
+                                                    lambda idxs: ner_session.predict_encoded([texts[i] for i in idxs], shard.get_batch(idxs)),
+                                                    batch_size=ner_config.get("batch_size", 32),
+                                                    desc="Batch "+str(batch_index),
+                                                    lengths=shard.lengths())
+        else:
+            predictions = ner_session.predict_batch(texts,
+                                                    batch_size=ner_config.get("batch_size", 32),
+                                                    desc="Batch "+str(batch_index))
+
+        for sentence, prediction in zip(sentences, predictions):
+            sentence["entities"] = [pred["word"] for pred in prediction]
+            sentence["entity_spans"] = [[pred["start"], pred["end"]] for pred in prediction]
         
         # for i, sentence in enumerate(sentences):
         #     try:
@@ -134,22 +210,290 @@ def run_ner_main(ner_config: dict, batch_file, device=-1):
         #     articles[pmid]["sentences"][i]["entities"] = entities_list
         #     articles[pmid]["sentences"][i]["entity_spans"] = entity_spans_list
 
+    return sentences
+
+def annotate_sentences_cached(ner_config: dict, sentences: list, batch_index, device=-1, shared=None, batch_file=None):
+    '''
+    annotate_sentences with the prediction cache in ner_config["prediction_cache"] (an SQLite file, "" disables it).
+    Sentences already predicted by the same model are taken from the cache, repeated sentences are predicted once,
+    and new predictions are added to the cache
+    '''
+    if not ner_config.get("prediction_cache", ""):
+        return annotate_sentences(ner_config, sentences, batch_index, device, shared=shared, batch_file=batch_file)
+
+    cache = prediction_cache.open_cache(ner_config["prediction_cache"])
+    model_id = prediction_cache.get_model_identity(ner_config)
 
-    util.append_to_json_file(f'{ner_config["output_path"]}/{ner_config["output_file_prefix"]}-{batch_index}.json', articles)        
+    hashes = [prediction_cache.get_sentence_hash(sentence["text"]) for sentence in sentences]
+    cached = cache.get_many(model_id, hashes)
+
+    # one representative sentence for every text that is not in the cache
+    missing = {}
+    for sentence, sentence_hash in zip(sentences, hashes):
+        if sentence_hash not in cached and sentence_hash not in missing:
+            missing[sentence_hash] = {"text": sentence["text"]}
+
+    if len(missing) > 0:
+        to_predict = list(missing.values())
+        if len(to_predict) < len(sentences):
+            # shared tokenization and the pre-tokenized store only hold the full list of sentences
+            shared, batch_file = None, None
+        annotate_sentences(ner_config, to_predict, batch_index, device, shared=shared, batch_file=batch_file)
+
+        new_predictions = {sentence_hash: {key: value for key, value in sentence.items() if key != "text"}
+                           for sentence_hash, sentence in missing.items()}
+        cache.put_many(model_id, new_predictions)
+        cached.update(new_predictions)
+
+    print(f"batch:{batch_index} predicted {len(missing)} unique new sentences, {len(sentences)-len(missing)} of {len(sentences)} reused")
+
+    for sentence, sentence_hash in zip(sentences, hashes):
+        sentence.update(cached[sentence_hash])
+
+    return sentences
+
+def annotate_sentences_filtered(ner_config: dict, sentences: list, batch_index, device=-1, shared=None, batch_file=None):
+    '''
+    annotate_sentences_cached behind the pre-filter in ner_config["prefilter"] (BioBERT models only). Sentences
+    the filter rejects get empty predictions without going through the model
+    '''
+    prefilter_config = ner_config.get("prefilter", {})
+    if (ner_config["model_type"] not in ['biobert_finetuned', 'biobert_onnx']
+            or not prefilter.is_enabled(prefilter_config)):
+        return annotate_sentences_cached(ner_config, sentences, batch_index, device, shared=shared, batch_file=batch_file)
+
+    sentence_filter = prefilter.load_filter(prefilter_config, cache_folder=ner_config.get("cache_folder", "models/cache/"))
+    candidates = []
+    for sentence, is_candidate in zip(sentences, sentence_filter.filter([sentence["text"] for sentence in sentences])):
+        if is_candidate:
+            candidates.append(sentence)
+        else:
+            sentence["entities"] = []
+            sentence["entity_spans"] = []
+
+    print(f"batch:{batch_index} pre-filter passed {len(candidates)} of {len(sentences)} sentences")
+
+    if len(candidates) < len(sentences):
+        # shared tokenization and the pre-tokenized store only hold the full list of sentences
+        shared, batch_file = None, None
+    if len(candidates) > 0:
+        annotate_sentences_cached(ner_config, candidates, batch_index, device, shared=shared, batch_file=batch_file)
+
+    return sentences
+
+def run_multi_model(ner_config: dict, sentences: list, batch_index, device=-1, batch_file=None):
+    '''
+    run every model in ner_config["models"] over the same sentences and write the merged output, where
+    entities and entity_spans are dicts keyed by entity type (same format as the entity merger)
+    '''
+    shared = {}
+    for sentence in sentences:
+        sentence["entities"] = {}
+        sentence["entity_spans"] = {}
+
+    for model_config in get_model_configs(ner_config):
+        tag = model_config["entity_type"]
+        model_sentences = [{"text": sentence["text"]} for sentence in sentences]
+        annotate_sentences_filtered(model_config, model_sentences, f'{batch_index} ({tag})', device, shared=shared, batch_file=batch_file)
+
+        for sentence, model_sentence in zip(sentences, model_sentences):
+            if "tokens" in model_sentence and "tokens" not in sentence:
+                sentence["tokens"] = model_sentence["tokens"]
+            if len(model_sentence["entities"]) > 0:
+                sentence["entities"][tag] = model_sentence["entities"]
+                sentence["entity_spans"][tag] = model_sentence["entity_spans"]
+
+    return sentences
+
+def get_output_file(ner_config: dict, batch_index):
+    '''
+    NER output file of a batch, in ner_config["output_format"] ("json" or "parquet")
+    '''
+    extension = storage.get_extension(ner_config.get("output_format", "json"))
+    return f'{ner_config["output_path"]}/{ner_config["output_file_prefix"]}-{batch_index}{extension}'
+
+def get_batch_index(batch_file):
+    '''
+    batch ID, the last number in the file name (see storage.get_shard_index)
+    '''
+    try:
+        return storage.get_shard_index(batch_file)
+    except IndexError:
+        print(batch_file)
+        raise Exception("Filenames not numbered!")
+
+def write_output(ner_config: dict, batch_file, output_file, articles: dict):
+    '''
+    write (merge) the tagged articles of a splitter file, add them to the article index and mark the file as done
+    '''
+    locations = storage.write_shard(output_file, articles, merge=True)
+    article_index.record_shard(ner_config.get("article_index", ""), ner_config["output_path"], output_file, articles, locations)
+    manifest.mark_done(ner_config["output_path"], os.path.basename(batch_file), output_file)
+
+def run_ner_main(ner_config: dict, batch_file, device=-1):
+    '''
+    run NER in batches from sentence splitter output (json or parquet)
+    '''
+
+    articles = storage.read_shard(batch_file)
+    
+    # get batch IDs
+    batch_index = get_batch_index(batch_file)
+        
+    if len(articles)==0:
+        write_output(ner_config, batch_file, get_output_file(ner_config, batch_index), articles)
+        return batch_index
+        
+    sentences = [sentence for pmid in articles for sentence in articles[pmid]["sentences"]]
+
+    if len(ner_config.get("models", [])) > 0:
+        run_multi_model(ner_config, sentences, batch_index, device, batch_file=batch_file)
+    else:
+        annotate_sentences_filtered(ner_config, sentences, batch_index, device, batch_file=batch_file)
+
+    write_output(ner_config, batch_file, get_output_file(ner_config, batch_index), articles)
     return batch_index
     
+_DONE = object()
+
+def _run_stage(target, errors):
+    '''
+    run a pipeline stage in a daemon thread, exceptions are collected in errors and re-raised by the runner
+    '''
+    def run():
+        try:
+            target()
+        except BaseException as e:
+            errors.append(e)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+def _put(q, item, running):
+    '''
+    put an item on a bounded queue, giving up once running() is false (e.g. the consumer stopped)
+    returns whether the item was put
+    '''
+    while running():
+        try:
+            q.put(item, timeout=1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def run_ner_pipelined(ner_config: dict, batch_files: list, device=-1, prefetch=2):
+    '''
+    run NER over several splitter output files with the stages overlapped: a reader thread parses the next files
+    (and tokenizes them for a single BioBERT model) while the model runs, and a writer thread writes finished files.
+    Queues hold at most prefetch files, so memory stays bounded
+
+    returns list of processed batch IDs
+    '''
+    # tokenize ahead only when the model sees every sentence of the file (no multi-model run, prediction cache or pre-filter)
+    tokenize_ahead = (ner_config["model_type"] in ['biobert_finetuned', 'biobert_onnx']
+                      and len(ner_config.get("models", [])) == 0
+                      and not ner_config.get("prediction_cache", "")
+                      and not prefilter.is_enabled(ner_config.get("prefilter", {})))
+    init_worker(ner_config, device)
+    # a fast tokenizer must not be used from two threads at once, the reader gets its own copy
+    reader_tokenizer = copy.deepcopy(load_model(ner_config, device).tokenizer) if tokenize_ahead else None
+
+    read_queue = queue.Queue(maxsize=prefetch)
+    write_queue = queue.Queue(maxsize=prefetch)
+    errors = []
+    # set when the runner stops, a reader blocked on a full queue gives up instead of holding its files forever
+    stop = threading.Event()
+    reading = lambda: not stop.is_set()
+
+    def read():
+        try:
+            for batch_file in batch_files:
+                if stop.is_set():
+                    return
+                articles = storage.read_shard(batch_file)
+                sentences = [sentence for pmid in articles for sentence in articles[pmid]["sentences"]]
+                encoded_batches = None
+                if tokenize_ahead and len(sentences) > 0:
+                    encoded_batches = encode_sentences(ner_config, sentences, batch_file, device, tokenizer=reader_tokenizer)
+                if not _put(read_queue, (batch_file, articles, sentences, encoded_batches), reading):
+                    return
+        finally:
+            _put(read_queue, _DONE, reading)
+
+    def write():
+        while True:
+            item = write_queue.get()
+            if item is _DONE:
+                return
+            batch_file, output_file, articles = item
+            write_output(ner_config, batch_file, output_file, articles)
+
+    reader = _run_stage(read, errors)
+    writer = _run_stage(write, errors)
+
+    batch_indices = []
+    try:
+        while True:
+            item = read_queue.get()
+            if item is _DONE or len(errors) > 0:
+                break
+            batch_file, articles, sentences, encoded_batches = item
+            batch_index = get_batch_index(batch_file)
+
+            try:
+                if len(sentences) > 0:
+                    if len(ner_config.get("models", [])) > 0:
+                        run_multi_model(ner_config, sentences, batch_index, device, batch_file=batch_file)
+                    elif encoded_batches is not None:
+                        annotate_sentences(ner_config, sentences, batch_index, device, batch_file=batch_file, encoded_batches=encoded_batches)
+                    else:
+                        annotate_sentences_filtered(ner_config, sentences, batch_index, device, batch_file=batch_file)
+            except Exception as e:
+                # leave the file out of the manifest so that it is retried, and go on with the next one
+                print(f"ERROR! NER failed for {batch_file}: {e!r}")
+                continue
+
+            if len(errors) > 0 or not _put(write_queue, (batch_file, get_output_file(ner_config, batch_index), articles), writer.is_alive):
+                break
+            batch_indices.append(batch_index)
+    finally:
+        stop.set()
+        if _put(write_queue, _DONE, writer.is_alive):
+            writer.join()
+
+    if len(errors) > 0:
+        raise errors[0]
+    reader.join()
+
+    return batch_indices
+
 def filter_files(list_files, start, end):
     '''
     filter files based on start and end
     '''
     filtered_list_files = []
     for f in list_files:
-        f_idx = int(os.path.splitext(os.path.basename(f))[0].split("-")[-1])
+        f_idx = storage.get_shard_index(f)
         if f_idx>=start and f_idx<=end:
             filtered_list_files.append(f)
     
     return filtered_list_files
 
+def get_sentence_rows(articles):
+    '''
+    flatten articles into a list of sentences
+    articles: sentence split articles from splitter
+
+    returns list of (pmid, sent_idx, text) rows
+    '''
+    rows = []
+    for pmid, content in articles.items():
+        for sent_idx, sent in enumerate(content["sentences"]):
+            rows.append((pmid, sent_idx, sent["text"]))
+
+    return rows
+
 def biobert_process_articles(articles, column_names=["pmid", "sent_idx", "text"]):
     '''
     process articles into a huggingface dataset
@@ -160,14 +504,7 @@ def biobert_process_articles(articles, column_names=["pmid", "sent_idx", "text"]
     '''
 
     
-    articles_processed = []
-    
-    for pmid, content in articles.items():
-        l = []
-        sent_idx = 0
-        for sent in content["sentences"]:
-            articles_processed.append([pmid, sent_idx, sent["text"]])
-            sent_idx+=1
+    articles_processed = get_sentence_rows(articles)
     
     articles_df = pd.DataFrame(articles_processed)
     articles_df.columns = column_names
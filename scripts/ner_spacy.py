@@ -1,39 +1,91 @@
 # coding=utf-8
 
+import os
 import spacy
 from spacy.matcher import PhraseMatcher
+from spacy.tokens import DocBin
+from tqdm import tqdm
+from . import util
 
-def run_ner_with_spacy(model_name, vocab_path, entity_type, sentences):
-    
-    # Prepare spacy, if it is needed
-    print("Running NER with spacy")
-    nlp = spacy.load(model_name)
-    
-    terms = []
-    with open(vocab_path) as f:
-        for line in f:
-            x = line.strip()
-            terms.append(x)
-    
+# trained pipeline components that dictionary matching does not need, only the tokenizer is used
+_PIPELINE_COMPONENTS = ["tok2vec", "transformer", "tagger", "morphologizer", "parser", "senter",
+                        "attribute_ruler", "lemmatizer", "ner", "entity_ruler", "textcat"]
+
+
+def load_tokenizer(model_name):
+    '''
+    load a spacy model for tokenization only, without its pipeline components
+    '''
+    return spacy.load(model_name, exclude=_PIPELINE_COMPONENTS)
+
+
+def load_phrasematcher(nlp, model_name, vocab_path, entity_type, cache_folder="models/cache/"):
+    '''
+    build a LOWER PhraseMatcher from a dictionary file (one term per line).
+    The tokenized terms are stored in cache_folder as a DocBin keyed by a hash of the dictionary
+    file and spacy model, so later runs skip reading and tokenizing the dictionary
+    nlp: loaded spacy model
+    model_name: spacy model name, part of the cache key
+    vocab_path: path to dictionary
+    entity_type: match label
+    cache_folder: folder for compiled dictionaries, no caching if empty
+
+    returns PhraseMatcher
+    '''
+    cache_file = None
+    if cache_folder:
+        key = util.get_file_hash(vocab_path, model_name, nlp.meta.get("version", ""), spacy.__version__)
+        cache_file = os.path.join(cache_folder, f"phrasematcher-{os.path.splitext(os.path.basename(vocab_path))[0]}-{key}.spacy")
+
+    if cache_file and os.path.isfile(cache_file):
+        patterns = list(DocBin().from_disk(cache_file).get_docs(nlp.vocab))
+        print(f"Loaded compiled dictionary from {cache_file}")
+    else:
+        terms = []
+        with open(vocab_path,'r') as f:
+            for line in f:
+                x = line.strip()
+                terms.append(x)
+        patterns = list(nlp.tokenizer.pipe(terms))
+
+        if cache_file:
+            os.makedirs(cache_folder, exist_ok=True)
+            # write to a temporary file first so concurrent workers never read a half written cache
+            tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+            DocBin(attrs=["ORTH"], docs=patterns).to_disk(tmp_file)
+            os.replace(tmp_file, cache_file)
     print("Phraselist complete")
-    
-    matcher = PhraseMatcher(nlp.vocab, attr = "LOWER")
-    patterns = [nlp.make_doc(term) for term in terms]
+
+    matcher = PhraseMatcher(nlp.vocab, attr="LOWER")
     matcher.add(entity_type, patterns)
-    
-    for i, sentence in enumerate(sentences):
-        ner_class = entity_type
-        
-        doc = nlp(sentences["text"])
+
+    return matcher
+
+def run_phrasematcher(nlp, matcher, sentences, store_tokens="no", batch_size=256, desc=None, docs=None):
+    '''
+    match dictionary terms in a list of sentences. The matcher only uses the LOWER attribute, so the
+    sentences are only tokenized (no tagger, parser, ner or lemmatizer) and are tokenized in bulk
+    nlp: loaded spacy model, only its tokenizer is used
+    matcher: PhraseMatcher from load_phrasematcher
+    sentences: list of sentence dicts with "text", entities and spans are added in place
+    store_tokens: "yes" to add the list of tokens to each sentence
+    batch_size: number of sentences tokenized together
+    docs: optional already tokenized docs of the sentences, e.g. shared between several dictionaries
+
+    returns the sentences
+    '''
+    if docs is None:
+        docs = nlp.tokenizer.pipe((sentence["text"] for sentence in sentences), batch_size=batch_size)
+
+    for sentence, doc in tqdm(zip(sentences, docs), total=len(sentences), desc=desc):
         if store_tokens == "yes":
             tokens = []
             # tokens_idxs = []  #uncomment if you want a list of token character offsets within the sentence
             for token in doc:
                 tokens.append(token.text) #to get a list of tokens in the sentence
             # tokens_idxs.append(token.idx) #uncomment if you want a list of token character offsets within the sentence
-            articles[pmid]["sentences"][i]["tokens"] = tokens
+            sentence["tokens"] = tokens
 
-    
         entities = []
         spans = []
         matches = matcher(doc)
@@ -46,10 +98,21 @@ def run_ner_with_spacy(model_name, vocab_path, entity_type, sentences):
             last_char = span.end_char - 1
             spans.append((first_char, last_char)) 
 
+        sentence["entities"] = entities
+        sentence["entity_spans"] = spans
+
+    return sentences
+
 
-        articles[pmid]["sentences"][i]["NER class"] = ner_class
-        articles[pmid]["sentences"][i]["entities"] = entities
-        articles[pmid]["sentences"][i]["entity spans"] = spans
+def run_ner_with_spacy(model_name, vocab_path, entity_type, sentences, store_tokens="no", cache_folder="models/cache/"):
+    '''
+    run dictionary NER with the spacy PhraseMatcher on a list of sentence dicts
+    '''
+    print("Running NER with spacy")
+    nlp = load_tokenizer(model_name)
+    matcher = load_phrasematcher(nlp, model_name, vocab_path, entity_type, cache_folder=cache_folder)
+    
+    return run_phrasematcher(nlp, matcher, sentences, store_tokens=store_tokens)
 
 if __name__ == "__main__":
     pass
@@ -0,0 +1,90 @@
+# coding=utf-8
+## On-disk NER prediction cache keyed by (model identity, sentence text hash). Re-delivered abstracts (PubMed
+## update files and baselines, duplicated CORD-19 sources) are looked up instead of being predicted again
+
+import os
+import json
+import sqlite3
+import hashlib
+from pathlib import Path, PurePosixPath
+from . import util
+
+# configuration keys that change what a model predicts for a sentence
+_MODEL_KEYS = ["model_type", "model_folder", "model_name", "vocab_path", "entity_type", "quantize", "labels", "store_tokens"]
+
+
+def get_model_identity(ner_config: dict):
+    '''
+    identity of a configured model. Dictionaries are identified by their content, local model folders by
+    the size and modification time of their files, hub models by their name
+    '''
+    h = hashlib.sha256()
+    for key in _MODEL_KEYS:
+        h.update(f"{key}={ner_config.get(key, '')}\n".encode("utf-8"))
+
+    if ner_config.get("vocab_path", ""):
+        h.update(util.get_file_hash(ner_config["vocab_path"]).encode("utf-8"))
+
+    model_path = str(PurePosixPath(Path(ner_config.get("model_folder", ""), ner_config["model_name"])))
+    if os.path.isdir(model_path):
+        for name in sorted(os.listdir(model_path)):
+            stat = os.stat(os.path.join(model_path, name))
+            h.update(f"{name}:{stat.st_size}:{int(stat.st_mtime)}\n".encode("utf-8"))
+
+    return h.hexdigest()[:16]
+
+
+def get_sentence_hash(text: str):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class PredictionCache:
+
+    def __init__(self, db_path: str):
+        '''
+        SQLite store of predictions, safe to share between worker processes
+        '''
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(db_path, timeout=600)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS predictions (
+                                 model TEXT NOT NULL,
+                                 sentence TEXT NOT NULL,
+                                 prediction TEXT NOT NULL,
+                                 PRIMARY KEY (model, sentence)
+                             ) WITHOUT ROWID""")
+        self.conn.commit()
+
+    def get_many(self, model: str, sentence_hashes: list, chunk_size=500):
+        '''
+        returns dict of sentence hash -> prediction for the hashes found in the cache
+        '''
+        found = {}
+        unique = list(set(sentence_hashes))
+        for start in range(0, len(unique), chunk_size):
+            chunk = unique[start:start+chunk_size]
+            rows = self.conn.execute(f"SELECT sentence, prediction FROM predictions WHERE model = ? AND sentence IN ({','.join('?'*len(chunk))})",
+                                     [model, *chunk])
+            for sentence_hash, prediction in rows:
+                found[sentence_hash] = json.loads(prediction)
+
+        return found
+
+    def put_many(self, model: str, predictions: dict):
+        '''
+        store predictions, a dict of sentence hash -> prediction
+        '''
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO predictions (model, sentence, prediction) VALUES (?, ?, ?)",
+                                  [(model, sentence_hash, json.dumps(prediction, ensure_ascii=False))
+                                   for sentence_hash, prediction in predictions.items()])
+
+
+# open caches in this process, keyed by database path
+_caches = {}
+
+def open_cache(db_path: str):
+    if db_path not in _caches:
+        _caches[db_path] = PredictionCache(db_path)
+    return _caches[db_path]
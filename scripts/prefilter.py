@@ -0,0 +1,56 @@
+# coding=utf-8
+## Cheap high-recall sentence screen in front of the BioBERT models. A sentence is a candidate if it contains a
+## term of the entity type's lexicon (anywhere, also inside words) or matches one of the configured regular
+## expressions. Only candidates are sent to the transformer, the others get empty predictions
+
+import re
+from .ner_dictionary import DictionaryAutomaton
+
+
+class SentenceFilter:
+
+    def __init__(self, automaton=None, patterns=[]):
+        '''
+        automaton: DictionaryAutomaton of the lexicon, or None
+        patterns: list of regular expressions
+        '''
+        self.automaton = automaton
+        self.patterns = [re.compile(pattern) for pattern in patterns]
+
+    @classmethod
+    def from_config(cls, prefilter_config: dict, cache_folder="models/cache/"):
+        '''
+        prefilter_config: {"vocab_path": lexicon file (one term per line), "patterns": [regular expressions],
+                           "min_term_length": lexicon terms shorter than this are left out, they would pass almost every sentence}
+        '''
+        automaton = None
+        if prefilter_config.get("vocab_path", ""):
+            automaton = DictionaryAutomaton.from_dictionary(prefilter_config["vocab_path"], cache_folder=cache_folder,
+                                                            min_length=prefilter_config.get("min_term_length", 3))
+        return cls(automaton, prefilter_config.get("patterns", []))
+
+    def is_candidate(self, text: str):
+        if self.automaton is not None and self.automaton.contains(text):
+            return True
+        return any(pattern.search(text) for pattern in self.patterns)
+
+    def filter(self, texts: list):
+        '''
+        returns list of booleans, True for the sentences that should be sent to the model
+        '''
+        return [self.is_candidate(text) for text in texts]
+
+
+def is_enabled(prefilter_config):
+    return bool(prefilter_config) and bool(prefilter_config.get("vocab_path", "") or prefilter_config.get("patterns", []))
+
+
+# filters built in this process, keyed by their configuration
+_filters = {}
+
+def load_filter(prefilter_config: dict, cache_folder="models/cache/"):
+    key = (prefilter_config.get("vocab_path", ""), tuple(prefilter_config.get("patterns", [])),
+           prefilter_config.get("min_term_length", 3), cache_folder)
+    if key not in _filters:
+        _filters[key] = SentenceFilter.from_config(prefilter_config, cache_folder=cache_folder)
+    return _filters[key]
@@ -0,0 +1,172 @@
+# coding=utf-8
+## Pre-tokenization stage: run the BioBERT WordPiece tokenizer with offset mappings over the splitter output once
+## and store input_ids and offsets as memory-mappable numpy arrays, reused by every BioBERT-family NER run
+## with the same tokenizer
+
+import os
+import json
+import hashlib
+import numpy as np
+from pathlib import Path, PurePosixPath
+from transformers import AutoTokenizer
+from . import storage
+
+
+def get_tokenizer_key(tokenizer, model_max_length):
+    '''
+    identity of a tokenizer (vocabulary, normalization and truncation length), models that share it share the store
+    '''
+    # truncation and padding are runtime settings of the backend tokenizer, they change with every call
+    state = json.loads(tokenizer.backend_tokenizer.to_str())
+    state.pop("truncation", None)
+    state.pop("padding", None)
+    h = hashlib.sha256(json.dumps(state, sort_keys=True).encode("utf-8"))
+    h.update(str(model_max_length).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def get_store_folder(store_path, tokenizer, model_max_length):
+    return os.path.join(store_path, get_tokenizer_key(tokenizer, model_max_length))
+
+
+def get_texts_hash(texts):
+    h = hashlib.sha256()
+    for text in texts:
+        h.update(text.encode("utf-8"))
+        h.update(b"\n")
+    return h.hexdigest()
+
+
+def _shard_prefix(store_folder, batch_file):
+    name = os.path.basename(batch_file).split(".")[0]
+    return os.path.join(store_folder, name)
+
+
+def pretokenize_file(tokenizer, batch_file, store_folder, model_max_length=192, batch_size=1000):
+    '''
+    tokenize all sentences of one splitter output file and store them in store_folder
+    input_ids.npy: input ids of all sentences, concatenated (int32)
+    offsets.npy: character offsets of each token within its sentence (int32, shape (tokens, 2))
+    special.npy: special tokens mask (uint8)
+    index.npy: position of the first token of each sentence in the arrays above, plus the total (int64)
+    meta.json: number of sentences and a hash of the sentence texts to detect a changed splitter output
+    '''
+    articles = storage.read_shard(batch_file)
+
+    texts = [sentence["text"] for pmid in articles for sentence in articles[pmid]["sentences"]]
+
+    input_ids = []
+    offsets = []
+    special = []
+    index = [0]
+    for start in range(0, len(texts), batch_size):
+        encodings = tokenizer(texts[start:start+batch_size],
+                              truncation=True,
+                              max_length=model_max_length,
+                              return_offsets_mapping=True,
+                              return_special_tokens_mask=True)
+        for ids, offs, spec in zip(encodings["input_ids"], encodings["offset_mapping"], encodings["special_tokens_mask"]):
+            input_ids.extend(ids)
+            offsets.extend(offs)
+            special.extend(spec)
+            index.append(index[-1]+len(ids))
+
+    os.makedirs(store_folder, exist_ok=True)
+    prefix = _shard_prefix(store_folder, batch_file)
+    np.save(f"{prefix}.input_ids.npy", np.asarray(input_ids, dtype=np.int32))
+    np.save(f"{prefix}.offsets.npy", np.asarray(offsets, dtype=np.int32).reshape(-1, 2))
+    np.save(f"{prefix}.special.npy", np.asarray(special, dtype=np.uint8))
+    np.save(f"{prefix}.index.npy", np.asarray(index, dtype=np.int64))
+
+    # meta is written last, a shard without meta is incomplete
+    with open(f"{prefix}.meta.json", "w", encoding="utf-8") as f:
+        f.write(json.dumps({"n_sentences": len(texts), "texts_hash": get_texts_hash(texts)}))
+
+    return len(texts)
+
+
+class PretokenizedShard:
+
+    def __init__(self, prefix, pad_token_id=0):
+        '''
+        memory-mapped view of one pre-tokenized splitter output file
+        '''
+        self.input_ids = np.load(f"{prefix}.input_ids.npy", mmap_mode="r")
+        self.offsets = np.load(f"{prefix}.offsets.npy", mmap_mode="r")
+        self.special = np.load(f"{prefix}.special.npy", mmap_mode="r")
+        self.index = np.load(f"{prefix}.index.npy")
+        self.pad_token_id = pad_token_id
+
+    def __len__(self):
+        return len(self.index)-1
+
+    def lengths(self):
+        '''
+        number of tokens of each sentence
+        '''
+        return np.diff(self.index)
+
+    def get_batch(self, idxs):
+        '''
+        padded encodings for the given sentences, in the same layout as the tokenizer output
+        '''
+        lengths = [int(self.index[i+1]-self.index[i]) for i in idxs]
+        max_length = max(lengths)
+
+        input_ids = np.full((len(idxs), max_length), self.pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros((len(idxs), max_length), dtype=np.int64)
+        offset_mapping = np.zeros((len(idxs), max_length, 2), dtype=np.int64)
+        special_tokens_mask = np.ones((len(idxs), max_length), dtype=np.int64)
+
+        for b, (i, length) in enumerate(zip(idxs, lengths)):
+            start = int(self.index[i])
+            input_ids[b, :length] = self.input_ids[start:start+length]
+            attention_mask[b, :length] = 1
+            offset_mapping[b, :length] = self.offsets[start:start+length]
+            special_tokens_mask[b, :length] = self.special[start:start+length]
+
+        return {"input_ids": input_ids,
+                "attention_mask": attention_mask,
+                "token_type_ids": np.zeros_like(input_ids),
+                "offset_mapping": offset_mapping,
+                "special_tokens_mask": special_tokens_mask}
+
+
+def load_shard(store_path, tokenizer, model_max_length, batch_file, texts):
+    '''
+    load the pre-tokenized store of a splitter output file for this tokenizer
+    returns PretokenizedShard, or None if the file was not pre-tokenized or its sentences have changed since
+    '''
+    prefix = _shard_prefix(get_store_folder(store_path, tokenizer, model_max_length), batch_file)
+    if not os.path.isfile(f"{prefix}.meta.json"):
+        return None
+
+    with open(f"{prefix}.meta.json", "r", encoding="utf-8") as f:
+        meta = json.loads(f.read())
+
+    if meta["n_sentences"] != len(texts) or meta["texts_hash"] != get_texts_hash(texts):
+        print(f"Pre-tokenized store for {batch_file} is out of date, tokenizing on the fly")
+        return None
+
+    return PretokenizedShard(prefix, pad_token_id=tokenizer.pad_token_id or 0)
+
+
+_tokenizers = {}
+
+def _load_tokenizer(model_dir, model_name, model_max_length):
+    key = (model_dir, model_name, model_max_length)
+    if key not in _tokenizers:
+        model_path = PurePosixPath(Path(model_dir, model_name))
+        _tokenizers[key] = AutoTokenizer.from_pretrained(model_path, model_max_length=model_max_length)
+    return _tokenizers[key]
+
+
+def run_pretokenizer_file(pretokenizer_config, batch_file):
+    '''
+    pre-tokenize one splitter output file, the tokenizer is loaded once per process
+    '''
+    model_max_length = pretokenizer_config.get("model_max_length", 192)
+    tokenizer = _load_tokenizer(pretokenizer_config["model_folder"], pretokenizer_config["model_name"], model_max_length)
+    store_folder = get_store_folder(pretokenizer_config["output_path"], tokenizer, model_max_length)
+
+    return pretokenize_file(tokenizer, batch_file, store_folder, model_max_length=model_max_length)
@@ -13,6 +13,7 @@ import requests
 import urllib.request
 import time
 from tqdm import tqdm, trange
+from . import storage
 
 def bulk_download(n_start=0, n_end=10000, nupdate=False, u_start=1167, u_end=3000, save_path="data/tmp/pubmed/", baseline=23):
     '''
@@ -66,16 +67,16 @@ def count_articles(input_path, baseline=23):
     k = str(baseline)+"n"
     count_file = input_path + "counts.txt"
     pmid_file = input_path + "pmid_list.txt"
-    input_files = sorted(glob(f'{input_path}*.json'), key=lambda x: int(os.path.splitext(os.path.basename(x))[0].split(k)[-1]))
+    input_files = sorted([f for f in glob(f'{input_path}*.json*') if storage.get_format(f) == "json"],
+                         key=lambda x: int(storage.strip_extension(x).split(k)[-1]))
     # print(input_files)
     count_writer = open(count_file, "w", encoding="utf-8")
     pmid_writer  = open(pmid_file, "w", encoding="utf-8")
     
     for infile in tqdm(input_files):
-        with open(infile, "r",encoding="utf-8") as f:
-                full_articles = json.loads(f.read())
+        full_articles = storage.read_json(infile)
         
-        count_writer.write(f"{os.path.splitext(os.path.basename(infile))[0].split(k)[-1]}\t{len(full_articles)}\n")
+        count_writer.write(f"{storage.strip_extension(infile).split(k)[-1]}\t{len(full_articles)}\n")
         count+=len(full_articles)
         pmids.extend([k for k in full_articles])
     
@@ -93,6 +94,7 @@ class PubMedLoader:
         self.input_path = input_path
         self.output_path = output_path
         self.counter = {}
+        self.deleted = {}
         os.makedirs(output_path, exist_ok=True)
         
     def get_input_files(self, input_path, k="23n"):
@@ -124,7 +126,12 @@ class PubMedLoader:
         
         count=0
         d_main = {}
+        deleted = []
         for art in data:
+            # DeleteCitation entries of nightly update files
+            if art.get("delete", False):
+                deleted.append(str(art["pmid"]).strip())
+                continue
             if "abstract" in art:
                 if isinstance(art["abstract"], str):
                     if len(art["abstract"])>0:
@@ -137,12 +144,17 @@ class PubMedLoader:
                                     "chemical_list":art["chemical_list"]}
         
         self.counter[input_file] = count
+        self.deleted[input_file] = deleted
         return d_main
 
     def write_to_json(self, data, input_file):
-        outfile = os.path.join(self.output_path, os.path.basename(input_file.split(".xml")[0])+".json")
-        with open(outfile, "w", encoding="utf-8") as f:
-            f.write(json.dumps(data, indent=2, ensure_ascii=False))
+        outfile = os.path.join(self.output_path, os.path.basename(input_file.split(".xml")[0])+storage.get_extension("json"))
+        storage.write_json(outfile, data)
+
+        # deleted PMIDs are kept next to the json file for the incremental splitter
+        if len(self.deleted.get(input_file, [])) > 0:
+            with open(os.path.join(self.output_path, storage.strip_extension(outfile) + ".deleted.txt"), "w", encoding="utf-8") as f:
+                f.write("\n".join(self.deleted[input_file]) + "\n")
             
     def run_loader(self):
         input_files_list = self.get_input_files(self.input_path)
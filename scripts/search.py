@@ -5,7 +5,7 @@ import json
 import os
 from tqdm import tqdm
 from glob import glob
-import util
+import storage
 
 class EntitySearch:
 
@@ -18,14 +18,11 @@ class EntitySearch:
         
     def sort_files(self, input_folder):
         
-        return sorted(glob(f'{input_folder}*.json'), key=lambda x: int(os.path.splitext(os.path.basename(x))[0].split("-")[-1]))
+        return storage.list_shards(input_folder)
         
     def read_files(self, input_file):
         
-        with open(input_file, encoding="utf8") as f:
-            articles = json.loads(f.read())
-        
-        return articles
+        return storage.read_shard(input_file, tokens=False)
         
     def search(self, input_files_list, entities):
         
@@ -62,7 +59,8 @@ class EntitySearch:
         
         main_dict = self.search(input_files_list, self.entities)
         
-        util.append_to_json_file(self.output_file, main_dict)
+        # appended to a .jsonl output file, merged into a .json one
+        storage.write_shard(self.output_file, main_dict, merge=True)
         
         
 
@@ -0,0 +1,148 @@
+# coding=utf-8
+
+import re
+import spacy
+from nltk.tokenize import sent_tokenize
+
+# pipeline components that take part in sentence segmentation, everything else is disabled
+_SENTENCE_COMPONENTS = {"tok2vec", "transformer", "parser", "senter", "sentencizer"}
+
+# one loaded spacy model per process, keyed by model name
+_spacy_models = {}
+
+# candidate boundary: terminal punctuation (plus closing quotes/brackets) followed by whitespace and an
+# upper case letter, digit or opening bracket. group 1 is the token in front of the punctuation
+_RULE_BOUNDARY = re.compile(r'(\S*?)([.!?]+)["\')\]]*\s+(?=["\'(\[]?[A-Z0-9])')
+
+# dotted abbreviations such as "e.g", "i.v", "s.c" or "U.S"
+_DOTTED_ABBREVIATION = re.compile(r'^(?:[A-Za-z]\.)+[A-Za-z]$')
+
+# common abbreviations in biomedical abstracts that are followed by a period but do not end a sentence
+_ABBREVIATIONS = {
+    "al", "approx", "ca", "cf", "dr", "eq", "eqs", "fig", "figs", "mr", "mrs", "ms", "no", "nos",
+    "prof", "ref", "refs", "resp", "sp", "spp", "ssp", "st", "subsp", "var", "viz", "vol", "vs",
+}
+
+
+def load_spacy_sentencizer(modelname):
+    '''
+    load a spacy model once per process and keep only the components needed for sentence boundaries
+    modelname: spacy model name, e.g. "en_core_web_sm"
+
+    returns the cached spacy language object
+    '''
+    if modelname not in _spacy_models:
+        nlp = spacy.load(modelname)
+        nlp.select_pipes(disable=[name for name in nlp.pipe_names if name not in _SENTENCE_COMPONENTS])
+
+        # models without a parser or senter still need something to set sentence boundaries
+        if not any(nlp.has_pipe(name) for name in ["parser", "senter", "sentencizer"]):
+            nlp.add_pipe("sentencizer")
+
+        _spacy_models[modelname] = nlp
+
+    return _spacy_models[modelname]
+
+
+def split_texts_spacy(texts, modelname, batch_size=64):
+    '''
+    split a list of texts into sentences with a cached spacy model, streaming the texts through nlp.pipe
+    texts: list of texts (abstracts)
+    modelname: spacy model name
+    batch_size: number of texts processed together by nlp.pipe
+
+    returns a list with a list of sentences for each text
+    '''
+    nlp = load_spacy_sentencizer(modelname)
+
+    return [[sentence.text for sentence in doc.sents] for doc in nlp.pipe(texts, batch_size=batch_size)]
+
+
+def split_into_sentences_rule(text):
+    '''
+    lightweight rule-based sentence segmenter for biomedical abstracts, needs no tagger or parser.
+    handles dotted abbreviations (e.g., i.v., s.c.), common abbreviations (et al., Fig., vs.),
+    abbreviated species names (E. coli) and decimal numbers (0.05)
+    text: text to split
+
+    returns list of sentences
+    '''
+    sentences = []
+    start = 0
+
+    for match in _RULE_BOUNDARY.finditer(text):
+        token = match.group(1).lstrip("\"'([")
+
+        if match.group(2) == ".":
+            if token.lower() in _ABBREVIATIONS or _DOTTED_ABBREVIATION.match(token):
+                continue
+            # initials and abbreviated genus names, e.g. "J. Smith" or "S. Typhimurium"
+            if len(token) == 1 and token.isupper():
+                continue
+
+        sentence = text[start:match.end()].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = match.end()
+
+    sentence = text[start:].strip()
+    if sentence:
+        sentences.append(sentence)
+
+    return sentences
+
+
+def split_texts_rule(texts):
+    '''
+    split a list of texts into sentences with the rule-based biomedical segmenter
+    '''
+    return [split_into_sentences_rule(text) for text in texts]
+
+
+def split_texts_nltk(texts):
+    '''
+    split a list of texts into sentences with the nltk punkt sentencer
+    '''
+    return [sent_tokenize(text) for text in texts]
+
+
+def split_texts(texts, tokenizer="spacy", model="en_core_web_sm", batch_size=64):
+    '''
+    split a list of texts into sentences with the chosen sentencer
+    texts: list of texts (abstracts)
+    tokenizer: "spacy", "nltk" or "rule" sentencer
+    model: specific spacy model if needed
+    batch_size: number of texts processed together by the spacy pipeline
+
+    returns a list with a list of sentences for each text
+    '''
+    if tokenizer == "spacy":
+        return split_texts_spacy(texts, model, batch_size=batch_size)
+    elif tokenizer == "nltk":
+        return split_texts_nltk(texts)
+    elif tokenizer == "rule":
+        return split_texts_rule(texts)
+    else:
+        raise Exception("ERROR! Proper sentence splitter model not specified!")
+
+
+def split_articles(articles, tokenizer="spacy", model="en_core_web_sm", batch_size=64):
+    '''
+    split the abstracts of a batch of articles into sentences
+    articles: dict of article ID -> article with "title" and "abstract"
+    tokenizer: "spacy", "nltk" or "rule" sentencer
+    model: specific spacy model if needed
+    batch_size: number of abstracts processed together by the spacy pipeline
+
+    returns dict of article ID -> {"title", "sentences"} in splitter output format
+    '''
+    ids = list(articles)
+    split_abstracts = split_texts([articles[idx]["abstract"] for idx in ids], tokenizer=tokenizer, model=model, batch_size=batch_size)
+
+    return {
+        idx: {
+            "title": articles[idx]["title"],
+            "sentences": [{"text": sentence} for sentence in sentences]
+        }
+        for idx, sentences in zip(ids, split_abstracts)
+    }
@@ -1,15 +1,35 @@
 # coding=utf-8
 
-import spacy
 from nltk.tokenize import sent_tokenize
 import json
 from tqdm import tqdm
+from . import article_index, manifest, sentencizer, storage, util
 
 def make_batches(list_id, n):
     #Yield n-size batches from list of ids
     for i in range(0, len(list_id), n):
         yield list_id[i:i + n]
         
+def stream_batches(input_file, n):
+    '''
+    parse the data loader output incrementally and yield n-size batches of articles as soon as they are read
+    input_file: JSON file (also compressed) with article ID -> article, or a jsonl shard (e.g. downloader output)
+    n: number of articles per batch
+    '''
+    if input_file.endswith(".jsonl"):
+        articles = storage.iter_jsonl(input_file)
+    else:
+        articles = util.iter_json_dict(input_file, opener=storage.open_file)
+    batch = {}
+    for idx, article in articles:
+        batch[idx] = article
+        if len(batch) == n:
+            yield batch
+            batch = {}
+
+    if len(batch) > 0:
+        yield batch
+        
 def split_into_sentences_nltk(text):
     sentences = sent_tokenize(text)
     return sentences
@@ -17,7 +37,7 @@ def split_into_sentences_nltk(text):
 
 def split_into_sentences_spacy(text,modelname):
     sentences = []
-    nlp = spacy.load(modelname)
+    nlp = sentencizer.load_spacy_sentencizer(modelname)
     doc = nlp(text)
 
     for sentence in doc.sents:
@@ -25,52 +45,29 @@ def split_into_sentences_spacy(text,modelname):
 
     return sentences
     
-def split_batch(splitter_config, batch_idx, batch, full_articles, tokenizer="spacy", model="en_core_web_sm"):
+def split_batch(splitter_config, batch_idx, batch, tokenizer="spacy", model="en_core_web_sm"):
     '''
     Description:
         split sentences in batches
         
     Parameters:
         batch_idx -> int: batch ID
-        batch -> list: full batch with article IDs (for example: pubmed ID)
-        full_articles -> dict: the entire collection of input articles with text
-        tokenizer -> str: "spacy" or "nltk" sentencer
+        batch -> dict: articles of this batch with text, keyed by article ID (for example: pubmed ID)
+        tokenizer -> str: "spacy", "nltk" or "rule" sentencer
         model -> str: specific spacy model if needed
         
     Returns:
         batch_idx and split articles TO BE written into JSON files
     '''
     
-    articles = {}
+    print(f'Splitting batch:{batch_idx} ({len(batch)} articles)')
+    articles = sentencizer.split_articles(batch, tokenizer=tokenizer, model=model)
 
-    for idx in tqdm(batch, desc=f'batch:{batch_idx}'):
-        article=full_articles[idx]
-        
-        if tokenizer=="spacy":
-        
-            articles[idx] = {
-                # **articles[id], # include other fields
-                "title": article["title"],
-                "sentences": list(map(
-                    lambda sentence: {"text": sentence},
-                    split_into_sentences_spacy(article["abstract"],model)
-                ))
-                }
-        elif tokenizer=="nltk":
-            articles[idx] = {
-                # **articles[id], # include other fields
-                "title": article["title"],
-                "sentences": list(map(
-                    lambda sentence: {"text": sentence},
-                    split_into_sentences_nltk(article["abstract"])
-                ))
-                }
-        else:
-            raise Exception("ERROR! Proper sentence splitter model not specified!")
-            
-    
-    with open(f'{splitter_config["output_folder"]}/{splitter_config["output_file_prefix"]}_{tokenizer}-split-{batch_idx}.json', "w",encoding="utf-8") as f:
-                    f.write(json.dumps(articles, indent=2, ensure_ascii=False))
+    extension = storage.get_extension(splitter_config.get("output_format", "json"))
+    output_file = f'{splitter_config["output_folder"]}/{splitter_config["output_file_prefix"]}_{tokenizer}-split-{batch_idx}{extension}'
+    locations = storage.write_shard(output_file, articles)
+    article_index.record_shard(splitter_config.get("article_index", ""), splitter_config["output_folder"], output_file, articles, locations)
+    manifest.mark_done(splitter_config["output_folder"], f"batch-{batch_idx}", output_file)
     
     return batch_idx
     
@@ -0,0 +1,146 @@
+# coding=utf-8
+## This script compares sentence boundaries and throughput of the splitter modes (spacy, nltk and rule)
+## Run from the repository root: python -m scripts.splitter_benchmark -i results/dataloader/text.json
+
+import argparse
+import json
+import time
+from itertools import islice
+from . import sentencizer
+
+
+def get_boundaries(text, sentences):
+    '''
+    get character offsets where each sentence ends within the original text
+    text: original text
+    sentences: list of sentences split from the text
+
+    returns set of end offsets (the last sentence end is left out since it is the same for every splitter)
+    '''
+    boundaries = set()
+    pos = 0
+    for sentence in sentences:
+        start = text.find(sentence, pos)
+        if start == -1:
+            continue
+        pos = start + len(sentence)
+        boundaries.add(pos)
+
+    boundaries.discard(len(text.rstrip()))
+    return boundaries
+
+
+def compare_boundaries(texts, reference, predicted):
+    '''
+    compare sentence boundaries of a splitter with a reference splitter
+    texts: list of original texts
+    reference, predicted: list of sentence lists for each text
+
+    returns precision, recall and f1 of predicted boundaries and the share of texts split identically
+    '''
+    tp = fp = fn = identical = 0
+    for text, ref, pred in zip(texts, reference, predicted):
+        ref_boundaries = get_boundaries(text, ref)
+        pred_boundaries = get_boundaries(text, pred)
+        tp += len(ref_boundaries & pred_boundaries)
+        fp += len(pred_boundaries - ref_boundaries)
+        fn += len(ref_boundaries - pred_boundaries)
+        identical += ref_boundaries == pred_boundaries
+
+    precision = tp/(tp+fp) if tp+fp > 0 else 1.0
+    recall = tp/(tp+fn) if tp+fn > 0 else 1.0
+    f1 = 2*precision*recall/(precision+recall) if precision+recall > 0 else 0.0
+    return precision, recall, f1, identical/max(len(texts), 1)
+
+
+def run_benchmark(texts, tokenizers=["spacy", "nltk", "rule"], reference="spacy", model="en_core_web_sm"):
+    '''
+    split the texts with each tokenizer, time it and compare boundaries against the reference tokenizer
+    texts: list of abstracts
+    tokenizers: splitter modes to benchmark
+    reference: splitter mode used as reference for boundary comparison
+    model: spacy model
+
+    returns list of result rows (dicts)
+    '''
+    if reference not in tokenizers:
+        tokenizers = [reference] + tokenizers
+
+    if "spacy" in tokenizers:
+        # model loading is a one-off cost per worker and is kept out of the timing
+        sentencizer.load_spacy_sentencizer(model)
+
+    splits = {}
+    timings = {}
+    for tokenizer in tokenizers:
+        start = time.perf_counter()
+        splits[tokenizer] = sentencizer.split_texts(texts, tokenizer=tokenizer, model=model)
+        timings[tokenizer] = time.perf_counter() - start
+
+    n_chars = sum(len(text) for text in texts)
+    results = []
+    for tokenizer in tokenizers:
+        precision, recall, f1, identical = compare_boundaries(texts, splits[reference], splits[tokenizer])
+        results.append({
+            "tokenizer": tokenizer,
+            "seconds": timings[tokenizer],
+            "articles_per_sec": len(texts)/timings[tokenizer] if timings[tokenizer] > 0 else float("inf"),
+            "mb_per_sec": n_chars/1e6/timings[tokenizer] if timings[tokenizer] > 0 else float("inf"),
+            "speedup": timings[reference]/timings[tokenizer] if timings[tokenizer] > 0 else float("inf"),
+            "sentences": sum(len(s) for s in splits[tokenizer]),
+            "precision": precision,
+            "recall": recall,
+            "f1": f1,
+            "identical_articles": identical,
+        })
+
+    return results
+
+
+def load_texts(input_path, limit=1000):
+    '''
+    load abstracts from a data loader or pubmed bulk loader JSON file
+    '''
+    with open(input_path, "r", encoding="utf-8") as f:
+        articles = json.loads(f.read())
+
+    return [article["abstract"] for article in islice(articles.values(), limit)]
+
+
+def write_report(results, reference, output_file=None):
+    '''
+    print the benchmark results as a table and optionally write them to a TSV file
+    '''
+    cols = ["tokenizer", "seconds", "articles_per_sec", "mb_per_sec", "speedup", "sentences", "precision", "recall", "f1", "identical_articles"]
+    lines = ["\t".join(cols)]
+    for row in results:
+        lines.append("\t".join(f"{row[c]:.4f}" if isinstance(row[c], float) else str(row[c]) for c in cols))
+
+    print(f"Boundary precision/recall/f1 relative to: {reference}")
+    print("\n".join(lines))
+
+    if output_file:
+        with open(output_file, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+if __name__ == "__main__":
+
+    description = "Compare sentence boundaries and throughput of the spacy, nltk and rule-based splitters"
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('-i', "--input_path", type=str, required=True,
+                        help="JSON file with articles (output of a data loader or the pubmed bulk loader)")
+    parser.add_argument('-n', "--limit", type=int, required=False, default=1000,
+                        help="number of articles to benchmark")
+    parser.add_argument('-m', "--model_name", type=str, required=False, default="en_core_web_sm",
+                        help="spacy model")
+    parser.add_argument('-r', "--reference", type=str, required=False, default="spacy",
+                        help="splitter used as reference for boundary comparison")
+    parser.add_argument('-o', "--output_file", type=str, required=False, default=None,
+                        help="optional TSV file for the results")
+
+    args = parser.parse_args()
+
+    texts = load_texts(args.input_path, limit=args.limit)
+    results = run_benchmark(texts, reference=args.reference, model=args.model_name)
+    write_report(results, args.reference, output_file=args.output_file)
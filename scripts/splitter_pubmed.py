@@ -1,10 +1,10 @@
 # coding=utf-8
 
-import spacy
 from nltk.tokenize import sent_tokenize
 import json
 import os
 from tqdm import tqdm
+from . import article_index, manifest, sentencizer, storage
 from glob import glob
 
 def make_batches(list_id, n):
@@ -12,19 +12,25 @@ def make_batches(list_id, n):
     for i in range(0, len(list_id), n):
         yield list_id[i:i + n]
 
+def list_input_files(input_folder):
+    '''
+    converted pubmed files (json, also compressed) in a folder
+    '''
+    return [f for f in glob(f'{input_folder}*.json*') if storage.get_format(f) == "json"]
+
 def load_pre_batched_files(input_folder, limit=[0,100000000],k="n"):
     if limit==[0,100000000] or limit=="ALL":
-        return sorted(glob(f'{input_folder}*.json'), key=lambda x: int(os.path.splitext(os.path.basename(x))[0].split(k)[-1]))
+        return sorted(list_input_files(input_folder), key=lambda x: get_batch_index(x, k))
         
     elif isinstance(limit,list):
         
         if len(limit)==2:
             if limit[0]>limit[1]:
                  raise Exception("Error! Make sure to enter in the format of [#,#] where # represents lower and upper limit numbers respectively")
-            all_files = sorted(glob(f'{input_folder}*.json'), key=lambda x: int(os.path.splitext(os.path.basename(x))[0].split(k)[-1]))
+            all_files = sorted(list_input_files(input_folder), key=lambda x: get_batch_index(x, k))
             processed_files = []
             for f in all_files:
-                fidx = int(os.path.splitext(os.path.basename(f))[0].split(k)[-1])
+                fidx = get_batch_index(f, k)
                 if fidx>=limit[0] and fidx<=limit[1]:
                     processed_files.append(f)    
             return processed_files
@@ -38,11 +44,10 @@ def load_pre_batched_files(input_folder, limit=[0,100000000],k="n"):
              
 
 def load_json(input_file):
-    with open(input_file, "r",encoding="utf-8") as f:
-        return json.loads(f.read())
+    return storage.read_json(input_file)
 
 def get_batch_index(input_file, k="n"):
-    return int(os.path.splitext(os.path.basename(input_file))[0].split(k)[-1])
+    return int(storage.strip_extension(input_file).split(k)[-1])
         
 def split_into_sentences_nltk(text):
     sentences = sent_tokenize(text)
@@ -50,7 +55,7 @@ def split_into_sentences_nltk(text):
 
 def split_into_sentences_spacy(text,modelname):
     sentences = []
-    nlp = spacy.load(modelname)
+    nlp = sentencizer.load_spacy_sentencizer(modelname)
     doc = nlp(text)
 
     for sentence in doc.sents:
@@ -58,7 +63,7 @@ def split_into_sentences_spacy(text,modelname):
 
     return sentences
     
-def split_prebatch(splitter_config, input_file, tokenizer="spacy", model="en_core_web_sm"):
+def split_prebatch(splitter_config, input_file, tokenizer="spacy", model="en_core_web_sm", pmids=None):
     '''
     Description:
         split pre_batched pubmed files into sentences in batches
@@ -67,48 +72,30 @@ def split_prebatch(splitter_config, input_file, tokenizer="spacy", model="en_cor
         batch_idx -> int: batch ID
         batch -> list: full batch with article IDs (for example: pubmed ID)
         full_articles -> dict: the entire collection of input articles with text
-        tokenizer -> str: "spacy" or "nltk" sentencer
+        tokenizer -> str: "spacy", "nltk" or "rule" sentencer
         model -> str: specific spacy model if needed
+        pmids -> list: only split these articles of the file (incremental mode), all if None
         
     Returns:
         batch_idx and split articles TO BE written into JSON files
     '''
     
-    articles = {}
     # d = load_json(input_file=input_file)
     # batch = {k:d[k] for k in list(d)[:20]}
     batch = load_json(input_file=input_file)
+    if pmids is not None:
+        batch = {pmid: batch[pmid] for pmid in pmids}
     batch_idx = get_batch_index(input_file=input_file)
 
 
-    for idx in tqdm(batch, desc=f'batch:{batch_idx}'):
-        article=batch[idx]
-        
-        if tokenizer=="spacy":
-        
-            articles[idx] = {
-                # **articles[id], # include other fields
-                "title": article["title"],
-                "sentences": list(map(
-                    lambda sentence: {"text": sentence},
-                    split_into_sentences_spacy(article["abstract"],model)
-                ))
-                }
-        elif tokenizer=="nltk":
-            articles[idx] = {
-                # **articles[id], # include other fields
-                "title": article["title"],
-                "sentences": list(map(
-                    lambda sentence: {"text": sentence},
-                    split_into_sentences_nltk(article["abstract"])
-                ))
-                }
-        else:
-            raise Exception("ERROR! Proper sentence splitter model not specified!")
-            
-    
-    with open(f'{splitter_config["output_folder"]}/{splitter_config["output_file_prefix"]}_{tokenizer}-split-{batch_idx}.json', "w",encoding="utf-8") as f:
-                    f.write(json.dumps(articles, indent=2, ensure_ascii=False))
+    print(f'Splitting batch:{batch_idx} ({len(batch)} articles)')
+    articles = sentencizer.split_articles(batch, tokenizer=tokenizer, model=model)
+
+    extension = storage.get_extension(splitter_config.get("output_format", "json"))
+    output_file = f'{splitter_config["output_folder"]}/{splitter_config["output_file_prefix"]}_{tokenizer}-split-{batch_idx}{extension}'
+    locations = storage.write_shard(output_file, articles)
+    article_index.record_shard(splitter_config.get("article_index", ""), splitter_config["output_folder"], output_file, articles, locations)
+    manifest.mark_done(splitter_config["output_folder"], os.path.basename(input_file), output_file)
     
     return batch_idx
     
@@ -0,0 +1,633 @@
+# coding=utf-8
+## Shard formats for splitter and NER output. "json" is the original article dict ({pmid: {"title", "sentences"}});
+## "parquet" stores one row per sentence with pmid, sent_idx, title, text and the entities as offset and label
+## columns; "jsonl" is append-only, one [pmid, article] line per article and a footer line with the byte range of
+## every article; "compact" keeps the sentence text of an article once, with sentences, tokens and entities as
+## offset arrays. Readers convert all of them back to the article dict, so downstream scripts work with any format.
+## JSON files of every stage (loader output and json shards) go through one codec set by the "io" section of the
+## config: stdlib json or orjson, indented or compact, and optional gzip or zstd compression (".gz"/".zst" suffix)
+
+import os
+import re
+import gzip
+import json
+import threading
+from glob import glob
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FORMATS = {"json": ".json", "parquet": ".parquet", "jsonl": ".jsonl", "compact": ".compact.json"}
+
+COMPRESSIONS = {"": "", "gzip": ".gz", "zstd": ".zst"}
+
+# codec for JSON files, set with configure() in the main process and in every worker process
+_io = {"json_backend": "json", "indent": 2, "compression": ""}
+
+JSONL_INDEX_KEY = "__index__"
+
+# per-shard tables of the compact format, stored under this key next to the articles
+COMPACT_KEY = "__shard__"
+COMPACT_VERSION = 1
+
+if pa is not None:
+    _SCHEMA = pa.schema([("pmid", pa.string()),
+                         ("sent_idx", pa.int32()),
+                         ("title", pa.string()),
+                         ("text", pa.string()),
+                         ("entity_texts", pa.list_(pa.string())),
+                         ("entity_starts", pa.list_(pa.int32())),
+                         ("entity_ends", pa.list_(pa.int32())),
+                         ("entity_labels", pa.list_(pa.string())),
+                         ("tokens", pa.list_(pa.string()))])
+
+
+def configure(io_config: dict):
+    '''
+    io_config: {"json_backend": "json" or "orjson", "indent": 2 or null (compact),
+                "compression": "" (none), "gzip" or "zstd", applied to the json files the pipeline names itself}
+    '''
+    io_config = {**_io, **(io_config or {})}
+    if io_config["json_backend"] not in ["json", "orjson"]:
+        raise Exception(f'ERROR! Unknown json_backend: {io_config["json_backend"]}. Use "json" or "orjson"')
+    if io_config["json_backend"] == "orjson":
+        if orjson is None:
+            raise Exception("ERROR! The orjson backend needs orjson, install it with: pip install orjson")
+        if io_config["indent"] not in [None, 0, 2]:
+            raise Exception("ERROR! The orjson backend only writes compact json or an indent of 2")
+    if io_config["compression"] not in COMPRESSIONS:
+        raise Exception(f'ERROR! Unknown compression: {io_config["compression"]}. Use one of {list(COMPRESSIONS)}')
+    if io_config["compression"] == "zstd" and zstandard is None:
+        raise Exception("ERROR! zstd compression needs zstandard, install it with: pip install zstandard")
+
+    _io.update(io_config)
+
+
+def get_compression(path: str):
+    '''
+    compression of a file, from its suffix
+    '''
+    for compression, suffix in COMPRESSIONS.items():
+        if suffix and path.endswith(suffix):
+            return compression
+    return ""
+
+
+def get_format(path: str):
+    '''
+    shard format of a file (ignoring a compression suffix), None if it is not a shard
+    '''
+    name = path[:len(path)-len(COMPRESSIONS[get_compression(path)])]
+    # longest extension first, ".compact.json" also ends in ".json"
+    for fmt, extension in sorted(FORMATS.items(), key=lambda item: -len(item[1])):
+        if name.endswith(extension):
+            return fmt
+    return None
+
+
+def strip_extension(path: str):
+    '''
+    file name without directory, format and compression suffix, e.g. pubmed23n0001 for data/pubmed23n0001.json.zst
+    '''
+    name = os.path.basename(path)
+    name = name[:len(name)-len(COMPRESSIONS[get_compression(name)])]
+    fmt = get_format(name)
+    if fmt is not None:
+        return name[:len(name)-len(FORMATS[fmt])]
+    return os.path.splitext(name)[0]
+
+
+def get_extension(fmt="json"):
+    '''
+    extension of the files written in a format, json and compact files get the suffix of the configured compression
+    '''
+    if fmt not in FORMATS:
+        raise Exception(f"ERROR! Unknown output format: {fmt}. Use one of {list(FORMATS)}")
+    if fmt in ["json", "compact"]:
+        return FORMATS[fmt] + COMPRESSIONS[_io["compression"]]
+    return FORMATS[fmt]
+
+
+def open_file(path: str, mode="r", compression=None):
+    '''
+    open a file, transparently (de)compressing gzip and zstd. Text modes use utf-8
+    compression: defaults to the one given by the suffix of path
+    '''
+    compression = get_compression(path) if compression is None else compression
+    encoding = None if "b" in mode else "utf-8"
+    if compression == "gzip":
+        return gzip.open(path, mode if "b" in mode else mode + "t", compresslevel=6, encoding=encoding)
+    if compression == "zstd":
+        if zstandard is None:
+            raise Exception("ERROR! zstd compression needs zstandard, install it with: pip install zstandard")
+        return zstandard.open(path, mode, encoding=encoding)
+    return open(path, mode, encoding=encoding)
+
+
+def dumps(obj, compact=False):
+    '''
+    serialize with the configured backend and indent (compact: always on a single line)
+    '''
+    indent = None if compact else _io["indent"]
+    if _io["json_backend"] == "orjson":
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, option=option).decode("utf-8")
+    if indent:
+        return json.dumps(obj, indent=indent, ensure_ascii=False)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(data):
+    if _io["json_backend"] == "orjson":
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def read_json(path: str):
+    '''
+    read a (possibly compressed) json file
+    '''
+    with open_file(path, "rb") as f:
+        return loads(f.read())
+
+
+def write_json(path: str, obj):
+    '''
+    write a json file with the configured codec, compressed according to the suffix of path.
+    Written to a temporary file and renamed, so a crash never leaves a half written file behind
+    '''
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open_file(tmp_path, "w", compression=get_compression(path)) as f:
+        f.write(dumps(obj))
+    os.replace(tmp_path, path)
+
+
+def write_json_items(f, items):
+    '''
+    stream (key, value) pairs to a file opened in binary mode as one json object, in the same layout as dumps
+
+    returns dict of key -> [offset, length] of the bytes of each '"key": value' entry (in the uncompressed stream)
+    '''
+    indent = bool(_io["indent"])
+    locations = {}
+    pos = f.write(b"{")
+    for key, value in items:
+        separator = ("," if len(locations) > 0 else "") + ("\n" if indent else "")
+        # a single key object without its braces
+        entry = (dumps({key: value})[2:-2] if indent else dumps({key: value})[1:-1]).encode("utf-8")
+        pos += f.write(separator.encode("utf-8"))
+        locations[str(key)] = [pos, len(entry)]
+        pos += f.write(entry)
+    f.write(b"\n}" if indent and len(locations) > 0 else b"}")
+
+    return locations
+
+
+def read_json_entry(path: str, offset: int, length: int):
+    '''
+    read one '"key": value' entry of an uncompressed json file written by write_json_items
+
+    returns (key, value)
+    '''
+    with open(path, "rb") as f:
+        f.seek(offset)
+        entry = f.read(length)
+    return next(iter(loads(b"{" + entry + b"}").items()))
+
+
+def get_shard_index(path: str):
+    '''
+    batch index of a shard, the last number in its file name
+    '''
+    return int(re.findall(r'\d+', os.path.basename(path))[-1])
+
+
+def list_shards(folder: str):
+    '''
+    all json (also compressed), parquet and jsonl shards in a folder, sorted by batch index
+    (files without a batch number, like the run manifest, are left out)
+    '''
+    files = [path for path in glob(f'{folder}*') if get_format(path) is not None]
+    return sorted((path for path in files if re.search(r'\d', strip_extension(path))), key=get_shard_index)
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise Exception("ERROR! The parquet format needs pyarrow, install it with: pip install pyarrow")
+
+
+def articles_to_table(articles: dict):
+    '''
+    one row per sentence. Entities are stored as parallel lists of text, start, end and label; the label is the
+    entity type for merged output (entities keyed by type) and empty for single model output.
+    Articles without sentences are kept as a row with sent_idx -1
+    '''
+    _require_pyarrow()
+    columns = {name: [] for name in _SCHEMA.names}
+    entities_format = "none"
+
+    def add_row(pmid, sent_idx, title, sentence):
+        nonlocal entities_format
+        texts, starts, ends, labels = [], [], [], []
+        entities = sentence.get("entities", None)
+        if isinstance(entities, dict):
+            entities_format = "dict"
+            for label in entities:
+                for entity, span in zip(entities[label], sentence["entity_spans"][label]):
+                    texts.append(entity)
+                    starts.append(span[0])
+                    ends.append(span[1])
+                    labels.append(label)
+        elif entities is not None:
+            if entities_format == "none":
+                entities_format = "list"
+            for entity, span in zip(entities, sentence["entity_spans"]):
+                texts.append(entity)
+                starts.append(span[0])
+                ends.append(span[1])
+                labels.append("")
+
+        columns["pmid"].append(str(pmid))
+        columns["sent_idx"].append(sent_idx)
+        columns["title"].append(title)
+        columns["text"].append(sentence.get("text", None))
+        columns["entity_texts"].append(texts)
+        columns["entity_starts"].append(starts)
+        columns["entity_ends"].append(ends)
+        columns["entity_labels"].append(labels)
+        columns["tokens"].append(sentence.get("tokens", None))
+
+    for pmid, article in articles.items():
+        if len(article["sentences"]) == 0:
+            add_row(pmid, -1, article.get("title", ""), {})
+        for sent_idx, sentence in enumerate(article["sentences"]):
+            add_row(pmid, sent_idx, article.get("title", ""), sentence)
+
+    table = pa.Table.from_pydict(columns, schema=_SCHEMA)
+    return table.replace_schema_metadata({"entities_format": entities_format})
+
+
+def table_to_articles(table):
+    '''
+    inverse of articles_to_table
+    '''
+    metadata = table.schema.metadata or {}
+    entities_format = metadata.get(b"entities_format", b"none").decode("utf-8")
+    columns = table.to_pydict()
+
+    articles = {}
+    for i, pmid in enumerate(columns["pmid"]):
+        if pmid not in articles:
+            articles[pmid] = {"title": columns["title"][i], "sentences": []}
+        if columns["sent_idx"][i] < 0:
+            continue
+
+        sentence = {"text": columns["text"][i]}
+        if columns["tokens"][i] is not None:
+            sentence["tokens"] = columns["tokens"][i]
+
+        spans = [[start, end] for start, end in zip(columns["entity_starts"][i], columns["entity_ends"][i])]
+        if entities_format == "list":
+            sentence["entities"] = columns["entity_texts"][i]
+            sentence["entity_spans"] = spans
+        elif entities_format == "dict":
+            sentence["entities"] = {}
+            sentence["entity_spans"] = {}
+            for entity, span, label in zip(columns["entity_texts"][i], spans, columns["entity_labels"][i]):
+                sentence["entities"].setdefault(label, []).append(entity)
+                sentence["entity_spans"].setdefault(label, []).append(span)
+        articles[pmid]["sentences"].append(sentence)
+
+    return articles
+
+
+def _token_offsets(text: str, tokens: list):
+    '''
+    tokens as a flat [start, end, ...] list of offsets into the sentence, or the token strings themselves
+    if they can not be found in order in the text
+    '''
+    offsets = []
+    pos = 0
+    for token in tokens:
+        start = text.find(token, pos)
+        if start < 0:
+            return list(tokens)
+        offsets += [start, start+len(token)]
+        pos = start + len(token)
+    return offsets
+
+
+def articles_to_compact(articles: dict):
+    '''
+    compact layout of the article dict. Per article: "text" (the sentence texts joined by spaces, stored once),
+    "sentences" (flat [start, end, ...] offsets into text), "tokens" (per sentence, flat offsets into the sentence)
+    and "entities" (flat list of sentence index, start, end, label id, string id per entity; offsets into the sentence).
+    Labels without entities in a sentence (e.g. {"chem": []} in multi-model output) are kept in "empty_labels"
+    (flat list of sentence index, label id). Entity labels, and entity strings that differ from the text they span, are interned in per-shard tables under
+    "__shard__" (id -1 if there is none)
+    '''
+    labels, label_ids = [], {}
+    strings, string_ids = [], {}
+    entities_format = "none"
+
+    def intern(table, ids, value):
+        if value not in ids:
+            ids[value] = len(table)
+            table.append(value)
+        return ids[value]
+
+    compact = {}
+    for pmid, article in articles.items():
+        doc = {"title": article.get("title", "")}
+        fields = {key: value for key, value in article.items() if key not in ["title", "sentences"]}
+        if len(fields) > 0:
+            doc["fields"] = fields
+
+        texts, sentence_offsets, tokens, entities, empty_labels, extra = [], [], [], [], [], {}
+        pos = 0
+        for sent_idx, sentence in enumerate(article["sentences"]):
+            text = sentence.get("text", "")
+            sentence_offsets += [pos, pos+len(text)]
+            texts.append(text)
+            pos += len(text) + 1
+
+            tokens.append(_token_offsets(text, sentence["tokens"]) if sentence.get("tokens", None) is not None else None)
+
+            def add_entity(entity, span, label_id):
+                string_id = -1 if text[span[0]:span[1]] == entity else intern(strings, string_ids, entity)
+                entities.extend([sent_idx, span[0], span[1], label_id, string_id])
+
+            sentence_entities = sentence.get("entities", None)
+            if isinstance(sentence_entities, dict):
+                entities_format = "dict"
+                for label in sentence_entities:
+                    if len(sentence_entities[label]) == 0:
+                        empty_labels.extend([sent_idx, intern(labels, label_ids, label)])
+                    for entity, span in zip(sentence_entities[label], sentence["entity_spans"][label]):
+                        add_entity(entity, span, intern(labels, label_ids, label))
+            elif sentence_entities is not None:
+                if entities_format == "none":
+                    entities_format = "list"
+                for entity, span in zip(sentence_entities, sentence["entity_spans"]):
+                    add_entity(entity, span, -1)
+
+            other = {key: value for key, value in sentence.items() if key not in ["text", "tokens", "entities", "entity_spans"]}
+            if len(other) > 0:
+                extra[str(sent_idx)] = other
+
+        doc["text"] = " ".join(texts)
+        doc["sentences"] = sentence_offsets
+        if any(sentence_tokens is not None for sentence_tokens in tokens):
+            doc["tokens"] = tokens
+        if len(entities) > 0:
+            doc["entities"] = entities
+        if len(empty_labels) > 0:
+            doc["empty_labels"] = empty_labels
+        if len(extra) > 0:
+            doc["extra"] = extra
+        compact[str(pmid)] = doc
+
+    return {COMPACT_KEY: {"version": COMPACT_VERSION, "entities_format": entities_format,
+                          "labels": labels, "strings": strings},
+            **compact}
+
+
+def compact_to_articles(data: dict, tokens=True):
+    '''
+    inverse of articles_to_compact, the legacy article dict
+    tokens: rebuild the token lists (not needed by analysis and search)
+    '''
+    shard = data[COMPACT_KEY]
+    labels, strings, entities_format = shard["labels"], shard["strings"], shard["entities_format"]
+
+    articles = {}
+    for pmid, doc in data.items():
+        if pmid == COMPACT_KEY:
+            continue
+        text, offsets = doc["text"], doc["sentences"]
+        doc_tokens = doc.get("tokens", None) if tokens else None
+
+        sentences = []
+        for sent_idx in range(len(offsets)//2):
+            sentence_text = text[offsets[2*sent_idx]:offsets[2*sent_idx+1]]
+            sentence = {"text": sentence_text}
+            if doc_tokens is not None and doc_tokens[sent_idx] is not None:
+                sentence_tokens = doc_tokens[sent_idx]
+                if len(sentence_tokens) > 0 and isinstance(sentence_tokens[0], int):
+                    bounds = iter(sentence_tokens)
+                    sentence_tokens = [sentence_text[start:end] for start, end in zip(bounds, bounds)]
+                sentence["tokens"] = sentence_tokens
+            if entities_format == "list":
+                sentence["entities"], sentence["entity_spans"] = [], []
+            elif entities_format == "dict":
+                sentence["entities"], sentence["entity_spans"] = {}, {}
+            sentence.update(doc.get("extra", {}).get(str(sent_idx), {}))
+            sentences.append(sentence)
+
+        entities = doc.get("entities", [])
+        for i in range(0, len(entities), 5):
+            sent_idx, start, end, label_id, string_id = entities[i:i+5]
+            sentence = sentences[sent_idx]
+            entity = sentence["text"][start:end] if string_id < 0 else strings[string_id]
+            if entities_format == "dict":
+                sentence["entities"].setdefault(labels[label_id], []).append(entity)
+                sentence["entity_spans"].setdefault(labels[label_id], []).append([start, end])
+            else:
+                sentence["entities"].append(entity)
+                sentence["entity_spans"].append([start, end])
+
+        empty_labels = doc.get("empty_labels", [])
+        for i in range(0, len(empty_labels), 2):
+            sentence = sentences[empty_labels[i]]
+            sentence["entities"][labels[empty_labels[i+1]]] = []
+            sentence["entity_spans"][labels[empty_labels[i+1]]] = []
+
+        articles[pmid] = {"title": doc.get("title", ""), **doc.get("fields", {}), "sentences": sentences}
+
+    return articles
+
+
+def _jsonl_record(pmid, article):
+    return (dumps([str(pmid), article], compact=True) + "\n").encode("utf-8")
+
+
+def _read_last_line(f, chunk_size=1 << 16):
+    '''
+    offset and content of the last line of a binary file
+    '''
+    size = f.seek(0, os.SEEK_END)
+    # the newline ending the last line is not where it starts
+    end = size - 1
+    offset = 0
+    while end > 0:
+        start = max(0, end - chunk_size)
+        f.seek(start)
+        newline = f.read(end - start).rfind(b"\n")
+        if newline >= 0:
+            offset = start + newline + 1
+            break
+        end = start
+
+    f.seek(offset)
+    return offset, f.read(size - offset)
+
+
+def scan_jsonl(path: str):
+    '''
+    index of a jsonl shard, from its footer line or (if the last append did not finish, e.g. after a crash) by
+    scanning the records. A line cut off by a crash is left out
+
+    returns dict of pmid -> [offset, length] of the latest record of each article, and the offset where the records end
+    '''
+    with open(path, "rb") as f:
+        offset, line = _read_last_line(f)
+        if line.startswith(b"{") and line.endswith(b"\n"):
+            return json.loads(line)[JSONL_INDEX_KEY], offset
+
+        decoder = json.JSONDecoder()
+        index = {}
+        end = 0
+        f.seek(0)
+        for line in f:
+            if not line.endswith(b"\n") or line.startswith(b"{"):
+                break
+            # the pmid is the first element of the record, no need to parse the article
+            pmid, _ = decoder.raw_decode(line.decode("utf-8"), 1)
+            index[pmid] = [end, len(line)]
+            end += len(line)
+
+    return index, end
+
+
+class JsonlAppender:
+
+    def __init__(self, path: str):
+        '''
+        append articles to a jsonl shard. Records are added at the end of the file and the footer index is
+        written on close, so an append costs the size of the new articles, not of the whole shard.
+        Articles appended again replace their older record in the dict view (new overwrite old)
+        '''
+        self.path = path
+        if os.path.isfile(path):
+            self.index, self.end = scan_jsonl(path)
+            self.f = open(path, "r+b")
+        else:
+            self.index, self.end = {}, 0
+            self.f = open(path, "wb")
+        # drop the old footer (and a line cut off by a crash)
+        self.f.seek(self.end)
+        self.f.truncate()
+
+    def append(self, articles: dict):
+        '''
+        returns dict of pmid -> [offset, length] of the appended records
+        '''
+        locations = {}
+        for pmid, article in articles.items():
+            record = _jsonl_record(pmid, article)
+            self.f.write(record)
+            locations[str(pmid)] = [self.end, len(record)]
+            self.end += len(record)
+        self.f.flush()
+        self.index.update(locations)
+
+        return locations
+
+    def close(self):
+        self.f.write((json.dumps({JSONL_INDEX_KEY: self.index}) + "\n").encode("utf-8"))
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_jsonl(path: str, pmids=None):
+    '''
+    yield (pmid, article) for the latest record of every article in a jsonl shard, reading one record at a time
+    pmids: optional list of pmids to read, using the byte ranges of the index
+    '''
+    index, end = scan_jsonl(path)
+    with open(path, "rb") as f:
+        for pmid in (index if pmids is None else pmids):
+            if pmid not in index:
+                continue
+            offset, length = index[pmid]
+            f.seek(offset)
+            yield pmid, loads(f.read(length))[1]
+
+
+def read_jsonl(path: str, pmids=None):
+    '''
+    dict view of a jsonl shard
+    '''
+    return dict(iter_jsonl(path, pmids))
+
+
+def read_shard(path: str, tokens=True):
+    '''
+    read a json or compact (also compressed), parquet or jsonl shard into the article dict
+    tokens: False skips rebuilding the token lists of compact shards
+    '''
+    if path.endswith(".parquet"):
+        _require_pyarrow()
+        return table_to_articles(pq.read_table(path))
+    if path.endswith(".jsonl"):
+        return read_jsonl(path)
+    if get_format(path) == "compact":
+        return compact_to_articles(read_json(path), tokens=tokens)
+
+    return read_json(path)
+
+
+def write_shard(path: str, articles: dict, merge=False):
+    '''
+    write the article dict as json or compact (compressed if path has a .gz or .zst suffix), parquet or jsonl, depending on the extension of path. The shard is written to
+    a temporary file and renamed, so a crash never leaves a half written shard behind
+    merge: merge with the articles already in the file (new overwrite old).
+    jsonl shards are appended to instead of being rewritten, a crash during the append loses only the new articles
+
+    returns dict of pmid -> [offset, length] of the articles written to an uncompressed json or jsonl shard (for the
+    article index), None for other shards
+    '''
+    if merge and path.endswith(".jsonl"):
+        with JsonlAppender(path) as appender:
+            return appender.append(articles)
+
+    if merge and os.path.isfile(path):
+        articles = {**read_shard(path), **articles}
+
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    locations = None
+    if path.endswith(".parquet"):
+        pq.write_table(articles_to_table(articles), tmp_path, compression="zstd")
+    elif path.endswith(".jsonl"):
+        with JsonlAppender(tmp_path) as appender:
+            locations = appender.append(articles)
+    elif get_format(path) == "compact":
+        with open_file(tmp_path, "w", compression=get_compression(path)) as f:
+            f.write(dumps(articles_to_compact(articles)))
+    else:
+        with open_file(tmp_path, "wb", compression=get_compression(path)) as f:
+            locations = write_json_items(f, articles.items())
+        if get_compression(path):
+            locations = None
+    os.replace(tmp_path, path)
+
+    return locations
@@ -1,7 +1,7 @@
 # coding=utf-8
 import os
-import json
 from glob import glob
+from . import storage
 
 def load_freetext(input_folder, prefix):
     '''
@@ -27,8 +27,7 @@ def convert_to_json(result, output_file):
     '''
     convert results to JSON 
     '''
-    with open(output_file,  "w", encoding="utf-8") as f:
-        json.dump(result, f, ensure_ascii=False, indent=2)
+    storage.write_json(output_file, result)
     
 def run(freetext_config):
     os.makedirs(os.path.dirname(freetext_config["output_path"]), exist_ok=True)
@@ -0,0 +1,236 @@
+# coding=utf-8
+## Shared helpers for the BioBERT token classification backends: length bucketed batching and
+## the huggingface aggregation_strategy="max" post-processing for models run outside the HF pipeline
+
+import numpy as np
+from tqdm import tqdm
+
+
+def predict_in_length_buckets(sequences, predict_fn, batch_size=32, desc=None, lengths=None):
+    '''
+    predict a list of sentences in batches. Sentences are sorted by length first so that each
+    batch holds sentences of similar length and padding is kept to a minimum
+    sequences: list of sentences (or sentence indices)
+    predict_fn: function taking a list of sentences and returning one prediction per sentence
+    batch_size: number of sentences per forward pass
+    desc: optional progress bar description
+    lengths: optional length of each sentence (e.g. number of tokens), defaults to the number of characters
+
+    returns a list of predictions in the same order as the input sentences
+    '''
+    lengths = [len(sequence) for sequence in sequences] if lengths is None else lengths
+    order = sorted(range(len(sequences)), key=lambda i: lengths[i])
+    predictions = [[] for _ in sequences]
+
+    for start in tqdm(range(0, len(order), batch_size), desc=desc):
+        batch_idxs = order[start:start+batch_size]
+        batch = [sequences[i] for i in batch_idxs]
+        try:
+            batch_predictions = predict_fn(batch)
+        except Exception as e:
+            # retry one by one so a single sentence the model cannot handle (e.g. too long or
+            # untokenizable) does not cost the predictions of the whole batch
+            print(f"{desc or 'batch'}: prediction failed for {len(batch)} sentences, retrying one by one: {e!r}")
+            batch_predictions = []
+            for i, sequence in zip(batch_idxs, batch):
+                try:
+                    batch_predictions.append(predict_fn([sequence])[0])
+                except Exception as e:
+                    print(f"{desc or 'batch'}: sentence {i} was not predicted: {e!r}")
+                    batch_predictions.append([])
+
+        for i, prediction in zip(batch_idxs, batch_predictions):
+            predictions[i] = prediction
+
+    return predictions
+
+
+def encode_in_length_buckets(sequences, encode_fn, batch_size=32, lengths=None):
+    '''
+    tokenize a list of sentences ahead of inference, in the same length-sorted batches as predict_in_length_buckets
+    encode_fn: function taking a list of sentence indices and returning the encodings of the batch
+    lengths: optional length of each sentence, defaults to the number of characters
+
+    returns list of (sentence indices, encodings) pairs, encodings is None if the batch could not be tokenized
+    '''
+    lengths = [len(sequence) for sequence in sequences] if lengths is None else lengths
+    order = sorted(range(len(sequences)), key=lambda i: lengths[i])
+
+    batches = []
+    for start in range(0, len(order), batch_size):
+        batch_idxs = order[start:start+batch_size]
+        try:
+            encodings = encode_fn(batch_idxs)
+        except Exception as e:
+            # predict_encoded_batches falls back to one by one tokenization for this batch
+            print(f"tokenization failed for {len(batch_idxs)} sentences: {e!r}")
+            encodings = None
+        batches.append((batch_idxs, encodings))
+
+    return batches
+
+
+def predict_encoded_batches(sequences, batches, session, desc=None):
+    '''
+    run the model over batches from encode_in_length_buckets
+    session: model with encode and predict_encoded (NER_biobert or NERInferenceSession_biobert_onnx)
+
+    returns a list of predictions in the same order as the input sentences
+    '''
+    predictions = [[] for _ in sequences]
+
+    for batch_idxs, encodings in tqdm(batches, desc=desc):
+        batch = [sequences[i] for i in batch_idxs]
+        try:
+            if encodings is None:
+                raise ValueError("batch was not tokenized")
+            batch_predictions = session.predict_encoded(batch, encodings)
+        except Exception as e:
+            # same per sentence fallback as predict_in_length_buckets
+            print(f"{desc or 'batch'}: prediction failed for {len(batch)} sentences, retrying one by one: {e!r}")
+            batch_predictions = []
+            for i, sequence in zip(batch_idxs, batch):
+                try:
+                    batch_predictions.append(session.predict_encoded([sequence], session.encode([sequence]))[0])
+                except Exception as e:
+                    print(f"{desc or 'batch'}: sentence {i} was not predicted: {e!r}")
+                    batch_predictions.append([])
+
+        for i, prediction in zip(batch_idxs, batch_predictions):
+            predictions[i] = prediction
+
+    return predictions
+
+
+def encode_batch(tokenizer, sequences, model_max_length=192):
+    '''
+    tokenize a batch of sentences, padded to the longest sentence in the batch, with everything needed for aggregation
+    '''
+    return tokenizer(sequences,
+                     padding=True,
+                     truncation=True,
+                     max_length=model_max_length,
+                     return_token_type_ids=True,
+                     return_attention_mask=True,
+                     return_offsets_mapping=True,
+                     return_special_tokens_mask=True,
+                     return_tensors="np")
+
+
+def softmax(logits):
+    maxes = np.max(logits, axis=-1, keepdims=True)
+    shifted_exp = np.exp(logits - maxes)
+    return shifted_exp / shifted_exp.sum(axis=-1, keepdims=True)
+
+
+def _get_tag(entity_name):
+    if entity_name.startswith("B-"):
+        return "B", entity_name[2:]
+    elif entity_name.startswith("I-"):
+        return "I", entity_name[2:]
+    # not in B-/I- format, treated as continuation of the same tag
+    return "I", entity_name
+
+
+def _group_sub_entities(entities, tokenizer):
+    return {
+        "entity_group": entities[0]["entity"].split("-")[-1],
+        "score": np.nanmean([entity["score"] for entity in entities]),
+        "word": tokenizer.convert_tokens_to_string([entity["word"] for entity in entities]),
+        "start": entities[0]["start"],
+        "end": entities[-1]["end"],
+    }
+
+
+def aggregate_max(sentence, input_ids, offsets, special_tokens_mask, scores, tokenizer, id2label, ignore_labels=["O"]):
+    '''
+    turn token scores of one sentence into entity groups, the same way as the huggingface token
+    classification pipeline with aggregation_strategy="max"
+    sentence: sentence text
+    input_ids, offsets, special_tokens_mask, scores: per token arrays without padding
+    tokenizer: fast tokenizer of the model
+    id2label: label of each class index
+
+    returns list of dicts with entity_group, score, word, start, end
+    '''
+    has_subword_prefix = getattr(tokenizer._tokenizer.model, "continuing_subword_prefix", None)
+
+    # tokens with their scores, skipping special tokens
+    pre_entities = []
+    for idx, token_scores in enumerate(scores):
+        if special_tokens_mask[idx]:
+            continue
+        word = tokenizer.convert_ids_to_tokens(int(input_ids[idx]))
+        start, end = int(offsets[idx][0]), int(offsets[idx][1])
+        word_ref = sentence[start:end]
+        if has_subword_prefix:
+            is_subword = len(word) != len(word_ref)
+        else:
+            is_subword = start > 0 and " " not in sentence[start-1:start+1]
+        if int(input_ids[idx]) == tokenizer.unk_token_id:
+            word = word_ref
+            is_subword = False
+        pre_entities.append({"word": word, "scores": token_scores, "start": start, "end": end, "is_subword": is_subword})
+
+    if len(pre_entities) == 0:
+        return []
+
+    # group sub-word tokens into words, each word takes the label of its highest scoring token
+    word_groups = []
+    for entity in pre_entities:
+        if len(word_groups) == 0 or not entity["is_subword"]:
+            word_groups.append([entity])
+        else:
+            word_groups[-1].append(entity)
+
+    words = []
+    for group in word_groups:
+        max_entity = max(group, key=lambda entity: entity["scores"].max())
+        idx = int(max_entity["scores"].argmax())
+        words.append({
+            "entity": id2label[idx],
+            "score": max_entity["scores"][idx],
+            "word": tokenizer.convert_tokens_to_string([entity["word"] for entity in group]),
+            "start": group[0]["start"],
+            "end": group[-1]["end"],
+        })
+
+    # group consecutive words with the same tag into entities
+    entity_groups = []
+    disagg = []
+    for word in words:
+        if len(disagg) == 0:
+            disagg.append(word)
+            continue
+        bi, tag = _get_tag(word["entity"])
+        last_bi, last_tag = _get_tag(disagg[-1]["entity"])
+        if tag == last_tag and bi != "B":
+            disagg.append(word)
+        else:
+            entity_groups.append(_group_sub_entities(disagg, tokenizer))
+            disagg = [word]
+    if len(disagg) > 0:
+        entity_groups.append(_group_sub_entities(disagg, tokenizer))
+
+    return [entity for entity in entity_groups if entity["entity_group"] not in ignore_labels]
+
+
+def aggregate_batch(sequences, encodings, logits, tokenizer, id2label):
+    '''
+    aggregate the logits of a padded batch into entity groups for each sentence
+    sequences: list of sentences
+    encodings: tokenizer output with input_ids, attention_mask, offset_mapping and special_tokens_mask
+    logits: array of shape (batch, sequence, labels)
+
+    returns list of entity group lists, one for each sentence
+    '''
+    predictions = []
+    for b, sequence in enumerate(sequences):
+        length = int(encodings["attention_mask"][b].sum())
+        predictions.append(aggregate_max(sequence,
+                                         encodings["input_ids"][b][:length],
+                                         encodings["offset_mapping"][b][:length],
+                                         encodings["special_tokens_mask"][b][:length],
+                                         softmax(logits[b][:length]),
+                                         tokenizer, id2label))
+    return predictions
@@ -1,19 +1,85 @@
 # coding=utf-8
 
 import json
-import os
+import re
+import hashlib
 
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
 
-def append_to_json_file(path: str, new_data: dict):
-    if not os.path.isfile(path):
-        with open(path, "w", encoding="utf-8") as f:
-            f.write("{}")
 
-    with open(path, "r", encoding="utf-8") as f:
-        old_data = json.loads(f.read())
+def get_file_hash(path: str, *extra):
+    '''
+    hash of a file together with anything else derived data depends on (e.g. model name and version),
+    used as key for cached compiled dictionaries
+    '''
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    for x in extra:
+        h.update(str(x).encode("utf-8"))
 
-    data = {**old_data, **new_data}  # Merge dicts (new overwrites old)
+    return h.hexdigest()[:16]
 
-    with open(path, "w", encoding="utf-8") as f:
-        f.write(json.dumps(data, indent=2, ensure_ascii=False))
-        
+
+def iter_json_dict(path: str, chunk_size=1 << 20, opener=None):
+    '''
+    incrementally parse a JSON file holding one top-level object and yield its (key, value) pairs
+    without loading the whole file. Memory use is bounded by chunk_size plus the largest value.
+    path: path to JSON file, e.g. the output of a data loader
+    chunk_size: number of characters read from the file at a time
+    opener: function (path, mode) returning a text file, e.g. storage.open_file for compressed files
+    '''
+    decoder = json.JSONDecoder()
+
+    with (opener(path, "r") if opener else open(path, "r", encoding="utf-8")) as f:
+        buf = f.read(chunk_size)
+        pos = 0
+        eof = len(buf) == 0
+
+        def read_more(buf, pos):
+            # drop the consumed part of the buffer once it gets large and append the next chunk
+            if pos > chunk_size:
+                buf, pos = buf[pos:], 0
+            chunk = f.read(chunk_size)
+            return buf + chunk, pos, len(chunk) == 0
+
+        def skip_whitespace(buf, pos, eof):
+            pos = _WHITESPACE.match(buf, pos).end()
+            while pos == len(buf) and not eof:
+                buf, pos, eof = read_more(buf, pos)
+                pos = _WHITESPACE.match(buf, pos).end()
+            return buf, pos, eof
+
+        def decode(buf, pos, eof):
+            while True:
+                try:
+                    obj, end = decoder.raw_decode(buf, pos)
+                    # a value ending exactly at the buffer end (e.g. a number) may continue in the next chunk
+                    if end < len(buf) or eof:
+                        return obj, buf, end, eof
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                buf, pos, eof = read_more(buf, pos)
+
+        buf, pos, eof = skip_whitespace(buf, pos, eof)
+        if buf[pos:pos+1] != "{":
+            raise Exception(f"ERROR! {path} does not contain a JSON object!")
+        pos += 1
+
+        while True:
+            buf, pos, eof = skip_whitespace(buf, pos, eof)
+            if buf[pos:pos+1] == "}":
+                return
+            if buf[pos:pos+1] == ",":
+                buf, pos, eof = skip_whitespace(buf, pos+1, eof)
+
+            key, buf, pos, eof = decode(buf, pos, eof)
+            buf, pos, eof = skip_whitespace(buf, pos, eof)
+            if buf[pos:pos+1] != ":":
+                raise Exception(f"ERROR! Malformed JSON object in {path} at key {key}")
+            buf, pos, eof = skip_whitespace(buf, pos+1, eof)
+
+            value, buf, pos, eof = decode(buf, pos, eof)
+            yield key, value